@@ -1,6 +1,7 @@
 from . import (
     api,
     bot,
+    cache,
     cli,
     config,
     db,
@@ -36,6 +37,7 @@ __all__ = [
     # Modules & Sub-packages
     "api",
     "bot",
+    "cache",
     "cli",
     "config",
     "db",
@@ -1,7 +1,9 @@
+import asyncio
+import inspect
 import json
 import logging
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import Any, AsyncIterator, Callable
 
 from fastapi import FastAPI, HTTPException, Request, Response
 from telebot import types as telebot_types
@@ -9,14 +11,165 @@ from telebot.async_telebot import AsyncTeleBot
 
 from .. import handlers
 from ..bot import get_bot_instance
+from ..config import (
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_SKIP_UNHANDLED_UPDATES,
+    WEBHOOK_UPDATE_QUEUE_SIZE,
+    WEBHOOK_UPDATE_WORKERS,
+    WEBHOOK_URL,
+)
+from ..db import wait_for_pending_turn_saves
 
+# Root logging is owned by the entry point (cli.py in polling mode). When served
+# directly by an ASGI host, only fall back to a basic setup if none is configured.
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
 logger = logging.getLogger(__name__)
 
+# Parsers for the raw webhook body, fastest first: a single reused simdjson Parser
+# (its internal buffers are recycled between updates), then orjson, then stdlib json.
+# All of them accept the request bytes directly and raise ValueError on bad input.
+_loads_json_body: Callable[[bytes], Any]
+try:
+    import simdjson
+
+    # Safe to share: parsing happens synchronously on the event loop thread and
+    # the result is materialized before the next update can reuse the parser.
+    _simdjson_parser = simdjson.Parser()
+
+    def _loads_json_body_simdjson(body: bytes) -> Any:
+        parsed = _simdjson_parser.parse(body)
+        if isinstance(parsed, simdjson.Object):
+            return parsed.as_dict()
+        if isinstance(parsed, simdjson.Array):
+            return parsed.as_list()
+        return parsed
+
+    _loads_json_body = _loads_json_body_simdjson
+except ImportError:
+    try:
+        import orjson
+
+        _loads_json_body = orjson.loads
+    except ImportError:
+        _loads_json_body = json.loads
+
+# Specialized Update construction for the update types we handle. Update.de_json
+# calls ~24 sub-type constructors (one per possible field) for every update; the
+# fast path only builds the field that is present and passes None for the rest.
+# Anything with other top-level keys falls back to the stock de_json.
+_FAST_UPDATE_CTORS: dict[str, Callable[[Any], Any]] = {
+    "message": telebot_types.Message.de_json,
+    "callback_query": telebot_types.CallbackQuery.de_json,
+}
+_UPDATE_INIT_FIELDS: tuple[str, ...] = tuple(
+    inspect.signature(telebot_types.Update.__init__).parameters
+)[1:]
+_FAST_UPDATE_KEYS = frozenset(_FAST_UPDATE_CTORS) | {"update_id"}
+_fast_update_enabled = _FAST_UPDATE_KEYS <= set(_UPDATE_INIT_FIELDS)
+
+
+def _update_from_payload(
+    payload: Any,
+    *,
+    _update_cls: type[telebot_types.Update] = telebot_types.Update,
+    _ctors: tuple[tuple[str, Callable[[Any], Any]], ...] = tuple(
+        _FAST_UPDATE_CTORS.items()
+    ),
+    _fast_keys: frozenset[str] = _FAST_UPDATE_KEYS,
+    _init_fields: tuple[str, ...] = _UPDATE_INIT_FIELDS,
+    _enabled: bool = _fast_update_enabled,
+) -> telebot_types.Update:
+    # The keyword-only defaults bind the module-level tables at definition time so the
+    # per-update lookups are local reads; callers never pass them.
+    if not _enabled or type(payload) is not dict or not payload.keys() <= _fast_keys:
+        return _update_cls.de_json(payload)
+    fields = dict.fromkeys(_init_fields)
+    fields["update_id"] = payload["update_id"]
+    for key, ctor in _ctors:
+        value = payload.get(key)
+        if value is not None:
+            fields[key] = ctor(value)
+    return _update_cls(**fields)
+
+
+# Pre-encoded response bodies: passing bytes lets Response skip the str encode step.
+_PLAIN_TEXT_MEDIA_TYPE = "text/plain"
+_OK_BODY = b"OK"
+_PROCESSING_ERROR_BODY = b"Processing Error (check server logs)"
+
+# Health check payloads; the endpoint only selects one of these per request.
+_HEALTH_READY: dict[str, str] = {
+    "message": "Gemini Telegram Bot Webhook is active and bot is initialized."
+}
+_HEALTH_INIT_FAILED: dict[str, str] = {
+    "message": "Gemini Telegram Bot Webhook is active, but bot initialization FAILED."
+}
+_HEALTH_PENDING: dict[str, str] = {
+    "message": "Gemini Telegram Bot Webhook is active, but bot is not yet initialized (startup pending or issue)."
+}
+
+# Upper bound on accepted webhook bodies. Telegram updates are far smaller; anything
+# larger is rejected before it is buffered or parsed.
+_MAX_BODY_BYTES = 1 << 20
+
+# Quoted JSON keys of the update types with registered handlers. A body containing
+# none of them cannot produce a handled update, so it is acknowledged unparsed.
+# Matches inside nested objects or strings only cause a harmless full parse.
+_HANDLED_UPDATE_KEYS: tuple[bytes, ...] = tuple(
+    f'"{update_type}"'.encode() for update_type in handlers.HANDLED_UPDATE_TYPES
+)
+_SKIPPED_UPDATES_LOG_EVERY = 100
+_skipped_updates_count: int = 0
+
+# Full tracebacks are captured for the first and then every Nth processing error;
+# the rest log a one-line summary so an error storm cannot turn into a logging storm.
+_ERROR_TRACEBACK_EVERY = 100
+_processing_error_count: int = 0
+
+# Optional background dispatch (WEBHOOK_UPDATE_QUEUE_SIZE > 0): parsed updates are
+# queued and acknowledged immediately, and worker tasks run the handlers. Created
+# in the lifespan startup only when enabled; None means inline processing.
+_update_queue: asyncio.Queue[telebot_types.Update] | None = None
+_update_worker_tasks: list[asyncio.Task[None]] = []
+
 # Global bot instance, to be managed by the lifespan context
 _global_bot_instance: AsyncTeleBot | None = None
 _initialization_error: bool = False
 
 
+def _log_processing_error(update_id: int | None, error: Exception) -> None:
+    """Logs a failed update, keeping the full traceback only for sampled errors."""
+    global _processing_error_count
+    _processing_error_count += 1
+    if _processing_error_count % _ERROR_TRACEBACK_EVERY == 1:
+        logger.error(
+            "Error processing update ID %s (error #%d):",
+            update_id,
+            _processing_error_count,
+            exc_info=error,
+        )
+    else:
+        logger.error("Error processing update ID %s: %r", update_id, error)
+
+
+async def _update_worker(
+    bot: AsyncTeleBot, queue: asyncio.Queue[telebot_types.Update]
+) -> None:
+    """Processes queued updates until cancelled at shutdown."""
+    while True:
+        update = await queue.get()
+        try:
+            await bot.process_new_updates([update])
+            logger.info("Webhook worker finished update ID: %s", update.update_id)
+        except Exception as e:
+            _log_processing_error(update.update_id, e)
+        finally:
+            queue.task_done()
+
+
 def initialize_bot_for_fastapi() -> AsyncTeleBot | None:
     """
     Initializes the bot instance and registers handlers.
@@ -63,6 +216,33 @@ def initialize_bot_for_fastapi() -> AsyncTeleBot | None:
     return local_bot_instance
 
 
+async def _ensure_webhook_registered(bot: AsyncTeleBot, url: str) -> None:
+    """Points Telegram at this app unless it already is, with the same update filter."""
+    allowed_updates = list(handlers.HANDLED_UPDATE_TYPES)
+    try:
+        webhook_info = await bot.get_webhook_info()
+        if (
+            webhook_info.url == url
+            and sorted(webhook_info.allowed_updates or []) == sorted(allowed_updates)
+            and webhook_info.max_connections == WEBHOOK_MAX_CONNECTIONS
+        ):
+            logger.info("Telegram webhook already registered for this URL.")
+            return
+        # Telegram then only sends the update types the bot has handlers for.
+        await bot.set_webhook(
+            url=url,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=allowed_updates,
+        )
+        logger.info(
+            "Registered Telegram webhook (max_connections=%s, allowed_updates=%s).",
+            WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates,
+        )
+    except Exception as e:
+        logger.error("Failed to register Telegram webhook: %s", e, exc_info=True)
+
+
 @asynccontextmanager
 async def lifespan(
     app_instance: FastAPI,
@@ -70,7 +250,7 @@ async def lifespan(
     """
     Context manager to handle application startup and shutdown events.
     """
-    global _global_bot_instance, _initialization_error  # pylint: disable=global-statement
+    global _global_bot_instance, _initialization_error, _update_queue  # pylint: disable=global-statement
     logger.info("FastAPI application lifespan startup event triggered.")
 
     bot_instance_candidate = initialize_bot_for_fastapi()
@@ -87,12 +267,37 @@ async def lifespan(
         _global_bot_instance = bot_instance_candidate
         _initialization_error = False
 
+        if WEBHOOK_URL:
+            await _ensure_webhook_registered(bot_instance_candidate, WEBHOOK_URL)
+
+        if WEBHOOK_UPDATE_QUEUE_SIZE > 0:
+            _update_queue = asyncio.Queue(maxsize=WEBHOOK_UPDATE_QUEUE_SIZE)
+            for _ in range(max(1, WEBHOOK_UPDATE_WORKERS)):
+                _update_worker_tasks.append(
+                    asyncio.create_task(
+                        _update_worker(bot_instance_candidate, _update_queue)
+                    )
+                )
+            logger.info(
+                f"Webhook background dispatch enabled: queue size {WEBHOOK_UPDATE_QUEUE_SIZE}, "
+                f"{len(_update_worker_tasks)} worker(s)."
+            )
+
     yield  # Application runs here
 
-    # Shutdown logic (if any) can go here
     logger.info("FastAPI application lifespan shutdown event triggered.")
-    if _global_bot_instance:
-        pass
+    if _update_queue is not None:
+        pending = _update_queue.qsize()
+        if pending:
+            logger.warning(
+                f"Shutting down with {pending} queued update(s) unprocessed."
+            )
+        for task in _update_worker_tasks:
+            task.cancel()
+        await asyncio.gather(*_update_worker_tasks, return_exceptions=True)
+        _update_worker_tasks.clear()
+        _update_queue = None
+    await wait_for_pending_turn_saves()
     logger.info("FastAPI application shutdown complete.")
 
 
@@ -115,9 +320,13 @@ async def handle_telegram_webhook(request: Request) -> Response:
     """
     Handles incoming POST requests from Telegram.
     """
-    global _global_bot_instance, _initialization_error  # pylint: disable=global-statement
+    global _skipped_updates_count
 
-    if _initialization_error or _global_bot_instance is None:
+    # Handlers are registered once in the lifespan startup; a failed initialization
+    # always leaves the instance as None, so this single check covers both cases.
+    # The module global is read once and used through a local for the rest of the call.
+    bot = _global_bot_instance
+    if bot is None:
         logger.error(
             "Webhook called but bot instance is not available (initialization failed or not run)."
         )
@@ -126,37 +335,92 @@ async def handle_telegram_webhook(request: Request) -> Response:
             detail="Bot service temporarily unavailable due to initialization error",
         )
 
-    update_json_str: str = ""
-    update_id_str: str = "N/A"
-    try:
-        body_bytes = await request.body()
-        update_json_str = body_bytes.decode("utf-8")
-        if not update_json_str:
-            logger.warning("Webhook received POST request with empty body.")
-            raise HTTPException(status_code=400, detail="Empty body")
+    # Non-POST methods never reach this handler (the router answers 405), so the
+    # only cheap rejection left is an empty body; do it before entering the try.
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit():
+        if int(content_length) > _MAX_BODY_BYTES:
+            logger.warning(
+                "Webhook rejected body of declared size %s bytes.", content_length
+            )
+            raise HTTPException(status_code=413, detail="Body too large")
+    # Content-Length is optional (chunked requests omit it), so the cap is enforced
+    # while reading: the body is never buffered beyond _MAX_BODY_BYTES.
+    body_chunks: list[bytes] = []
+    body_size = 0
+    async for chunk in request.stream():
+        body_size += len(chunk)
+        if body_size > _MAX_BODY_BYTES:
+            logger.warning("Webhook rejected body exceeding %d bytes.", _MAX_BODY_BYTES)
+            raise HTTPException(status_code=413, detail="Body too large")
+        body_chunks.append(chunk)
+    body_bytes = b"".join(body_chunks)
+    if not body_bytes:
+        logger.warning("Webhook received POST request with empty body.")
+        raise HTTPException(status_code=400, detail="Empty body")
 
-        logger.debug(f"Webhook update body: {update_json_str[:500]}...")
-        update = telebot_types.Update.de_json(update_json_str)
-        update_id_str = str(update.update_id)
-        logger.info(f"Webhook processing update ID: {update_id_str}")
+    if WEBHOOK_SKIP_UNHANDLED_UPDATES and not any(
+        key in body_bytes for key in _HANDLED_UPDATE_KEYS
+    ):
+        _skipped_updates_count += 1
+        if _skipped_updates_count % _SKIPPED_UPDATES_LOG_EVERY == 1:
+            logger.info(
+                "Webhook skipped %d update(s) without handled types so far.",
+                _skipped_updates_count,
+            )
+        return Response(content=_OK_BODY, media_type=_PLAIN_TEXT_MEDIA_TYPE)
 
-        await _global_bot_instance.process_new_updates([update])
+    # The parsers accept bytes directly, so the body is never decoded to str.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Webhook update body: %r...", body_bytes[:500])
 
-        logger.info(f"Webhook finished processing update ID: {update_id_str}")
-        return Response(content="OK", media_type="text/plain")
-
-    except json.JSONDecodeError:
+    # Only parsing can make the request itself invalid; errors raised while the
+    # handlers run are reported separately so they never turn into a 400.
+    try:
+        update = _update_from_payload(_loads_json_body(body_bytes))
+    except ValueError:
         logger.error(
-            f"Failed to decode webhook body as JSON: {update_json_str!r}", exc_info=True
+            "Failed to decode webhook body as JSON: %r", body_bytes, exc_info=True
         )
         raise HTTPException(status_code=400, detail="Invalid JSON body")
-    except HTTPException:
-        raise
     except Exception as e:
-        logger.exception(f"Error processing update ID {update_id_str}:")
+        _log_processing_error(None, e)
+        return Response(
+            content=_PROCESSING_ERROR_BODY,
+            media_type=_PLAIN_TEXT_MEDIA_TYPE,
+            status_code=200,
+        )
+
+    update_id = update.update_id
+    try:
+        queue = _update_queue
+        if queue is not None:
+            try:
+                queue.put_nowait(update)
+                logger.info("Webhook queued update ID: %s", update_id)
+                return Response(content=_OK_BODY, media_type=_PLAIN_TEXT_MEDIA_TYPE)
+            except asyncio.QueueFull:
+                # Fall back to inline processing: the request itself then applies
+                # backpressure instead of the update being lost or buffered unbounded.
+                logger.warning(
+                    "Webhook update queue full; processing update ID %s inline.",
+                    update_id,
+                )
+
+        logger.info("Webhook processing update ID: %s", update_id)
+        # A fresh one-element list per request on purpose: process_new_updates awaits
+        # the handlers, so a shared reusable list would be overwritten by concurrent
+        # webhook requests running on the same event loop.
+        await bot.process_new_updates([update])
+
+        logger.info("Webhook finished processing update ID: %s", update_id)
+        return Response(content=_OK_BODY, media_type=_PLAIN_TEXT_MEDIA_TYPE)
+
+    except Exception as e:
+        _log_processing_error(update_id, e)
         return Response(
-            content="Processing Error (check server logs)",
-            media_type="text/plain",
+            content=_PROCESSING_ERROR_BODY,
+            media_type=_PLAIN_TEXT_MEDIA_TYPE,
             status_code=200,
         )
 
@@ -165,14 +429,8 @@ async def handle_telegram_webhook(request: Request) -> Response:
 async def root() -> dict[str, str]:
     """A simple health check endpoint."""
     if not _initialization_error and _global_bot_instance:
-        return {
-            "message": "Gemini Telegram Bot Webhook is active and bot is initialized."
-        }
+        return _HEALTH_READY
     elif _initialization_error:
-        return {
-            "message": "Gemini Telegram Bot Webhook is active, but bot initialization FAILED."
-        }
+        return _HEALTH_INIT_FAILED
     else:
-        return {
-            "message": "Gemini Telegram Bot Webhook is active, but bot is not yet initialized (startup pending or issue)."
-        }
+        return _HEALTH_PENDING
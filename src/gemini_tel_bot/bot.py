@@ -6,23 +6,28 @@ from telebot.async_telebot import AsyncTeleBot
 from .config import BOT_API_KEY
 
 logger = logging.getLogger(__name__)
+_cached_bot_instance: AsyncTeleBot | None = None
 
 
 def get_bot_instance() -> AsyncTeleBot | None:
-    """Initializes and returns the Telegram Bot instance."""
+    """Initializes and returns the Telegram Bot instance (cached)."""
+    global _cached_bot_instance
+    if _cached_bot_instance is not None:
+        return _cached_bot_instance
+
     logger.info("Initializing Telegram bot instance...")
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     if not BOT_API_KEY:
         logger.critical("BOT_API_KEY is not set. Cannot initialize Telegram bot.")
         return None
 
     try:
-        bot_object = AsyncTeleBot(BOT_API_KEY)
-        init_time = time.time() - start_time
+        _cached_bot_instance = AsyncTeleBot(BOT_API_KEY)
+        init_time = time.perf_counter() - start_time
         logger.info(f"Telegram bot instance created in {init_time:.4f} seconds.")
 
-        return bot_object
+        return _cached_bot_instance
     except Exception as e:
         logger.critical(f"Failed to create TeleBot instance: {e}", exc_info=True)
         return None
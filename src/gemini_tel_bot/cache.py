@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from time import monotonic
+from typing import Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """A small in-process LRU cache with an optional per-entry time-to-live.
+
+    Everything in this bot runs on a single asyncio event loop, so no locking is
+    needed. Entries are evicted least-recently-used first once maxsize is reached,
+    and expired entries are dropped lazily when they are looked up.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[V, float | None]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        expires_at = monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        expires_at = entry[1]
+        if expires_at is not None and expires_at <= monotonic():
+            del self._data[key]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def key_fingerprint(secret: str) -> bytes:
+    """Returns a short digest of a secret (e.g. an API key) for use as a cache key.
+
+    Caches indexed this way never keep the plaintext secret in their keys, and a
+    16-byte digest is smaller than the key string itself.
+    """
+    return blake2b(secret.encode(), digest_size=16).digest()
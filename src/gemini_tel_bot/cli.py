@@ -5,6 +5,7 @@ import sys
 from . import handlers
 from .bot import get_bot_instance
 from .config import BOT_MODE
+from .db import wait_for_pending_turn_saves
 
 log_level = logging.DEBUG if BOT_MODE == "polling" else logging.INFO
 logging.basicConfig(level=log_level, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -50,6 +51,8 @@ async def main() -> None:
             except Exception as e:
                 logger.critical(f"Bot polling failed: {e}", exc_info=True)
                 sys.exit(1)
+            finally:
+                await wait_for_pending_turn_saves()
         else:
             logger.critical("Failed to get bot instance. Cannot start polling.")
             sys.exit(1)
@@ -38,6 +38,54 @@ MAX_HISTORY_LENGTH_TURNS: int = int(os.getenv("MAX_HISTORY_LENGTH_TURNS", "20"))
 # Set to 0 or negative for no limit.
 DEFAULT_KEY_MESSAGE_LIMIT: int = int(os.getenv("DEFAULT_KEY_MESSAGE_LIMIT", "10"))
 
+# --- In-process caches ---
+# Seconds a user's settings are served from memory before being re-read from Supabase.
+# Writes made by this process invalidate the entry immediately. Set to 0 to disable.
+USER_SETTINGS_CACHE_TTL_SECONDS: float = float(
+    os.getenv("USER_SETTINGS_CACHE_TTL_SECONDS", "60")
+)
+USER_SETTINGS_CACHE_MAX_ENTRIES: int = 4096
+# Seconds a chat's reconstructed history is served from memory. Turns saved by this
+# process are appended to the cached copy, so this only bounds staleness against
+# writes made by other processes. Set to 0 to disable.
+HISTORY_CACHE_TTL_SECONDS: float = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "300"))
+HISTORY_CACHE_MAX_ENTRIES: int = 1024
+# Seconds the filtered model list for an API key is reused by /list_models and
+# /select_model. Set to 0 to query the Gemini API every time.
+MODELS_CACHE_TTL_SECONDS: float = float(os.getenv("MODELS_CACHE_TTL_SECONDS", "3600"))
+# Seconds a genai.Client is reused for an API key before it is rebuilt, bounding how
+# long a rotated or revoked key keeps a client (and its HTTP pools) alive. Set to 0
+# to keep clients until they are evicted.
+GENAI_CLIENT_CACHE_TTL_SECONDS: float = float(
+    os.getenv("GENAI_CLIENT_CACHE_TTL_SECONDS", "3600")
+)
+GENAI_CLIENT_CACHE_MAX_ENTRIES: int = 256
+
+# --- Webhook ---
+# When true, the webhook acknowledges updates whose raw body does not mention any
+# handled update type (see handlers.HANDLED_UPDATE_TYPES) without parsing them.
+WEBHOOK_SKIP_UNHANDLED_UPDATES: bool = os.getenv(
+    "WEBHOOK_SKIP_UNHANDLED_UPDATES", "true"
+).lower() in ("1", "true", "yes")
+
+# When > 0, the webhook acknowledges parsed updates immediately and hands them to
+# background worker tasks through a queue of this size (long-running servers only;
+# serverless platforms may freeze the process after the response). 0 = process inline.
+WEBHOOK_UPDATE_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_UPDATE_QUEUE_SIZE", "0"))
+WEBHOOK_UPDATE_WORKERS: int = int(os.getenv("WEBHOOK_UPDATE_WORKERS", "4"))
+
+# When set, the webhook app registers this URL with Telegram at startup (if it is not
+# already registered), limited to the handled update types, so setWebhook need not be
+# called by hand. MAX_CONNECTIONS caps Telegram's parallel HTTPS connections (1-100).
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# --- Concurrency ---
+# Maximum number of user messages processed (DB reads + Gemini calls) at the same time.
+# Further messages wait for a free slot instead of piling onto Supabase and Gemini.
+# Set to 0 for no limit.
+MAX_PARALLEL_HANDLERS: int = int(os.getenv("MAX_PARALLEL_HANDLERS", "10"))
+
 LOADING_ANIMATION_FILE_ID: str = os.getenv(
     "LOADING_ANIMATION_FILE_ID",
     "BAACAgQAAxkBAAIHpGgQtb7K66BEXtOAo4v3R9TBH1XRAALWGwACJbhpUF_ZfF4mEh3HNgQ",
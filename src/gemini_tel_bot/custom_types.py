@@ -5,6 +5,8 @@ from google.genai import client as genai_client
 from google.genai import types as genai_types
 
 HistoryTurn = genai_types.Content
+# (turn_index, role, parts) of a turn waiting to be written to chat_history.
+PendingTurn = tuple[int, Optional[str], Optional[list[genai_types.Part]]]
 
 
 class UserSettings(TypedDict):
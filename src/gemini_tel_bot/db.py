@@ -1,27 +1,84 @@
 import asyncio
+import functools
 import json
 import logging
-from time import time
+from time import perf_counter
+from typing import Any, Callable
 
 from google.genai import types as genai_types
 from supabase import AsyncClient, create_async_client
 from supabase.lib.client_options import AsyncClientOptions
 
+from .cache import LRUCache
 from .config import (
     DEFAULT_MODEL_NAME,
+    HISTORY_CACHE_MAX_ENTRIES,
+    HISTORY_CACHE_TTL_SECONDS,
     MAX_HISTORY_LENGTH_TURNS,
     SUPABASE_KEY,
     SUPABASE_URL,
+    USER_SETTINGS_CACHE_MAX_ENTRIES,
+    USER_SETTINGS_CACHE_TTL_SECONDS,
 )
 from .custom_types import (
     HistoryTurn,
+    PendingTurn,
     SerializedPart,
     UserSettings,
     UserSettingsTableRowUpsert,
 )
 
 logger = logging.getLogger(__name__)
+
+# orjson decodes stored parts_json strings several times faster than stdlib json;
+# both raise ValueError subclasses on malformed input.
+_json_loads: Callable[[str | bytes], Any]
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 _cached_supabase_client: AsyncClient | None = None
+# Held while the client is being created, so a burst of updates arriving before it
+# exists shares one client (and its connection pool) instead of each building one.
+_supabase_client_lock = asyncio.Lock()
+# Settings change only through save_user_settings_to_db, which drops the entry, so the
+# TTL only bounds staleness against writes made by other processes.
+_user_settings_cache: LRUCache[int, UserSettings] = LRUCache(
+    USER_SETTINGS_CACHE_MAX_ENTRIES, ttl=USER_SETTINGS_CACHE_TTL_SECONDS
+)
+_SETTINGS_CACHE_STATS_LOG_EVERY = 500
+# Reconstructed history of a chat together with the next free turn_index. Turns saved
+# by this process are appended to the entry, so a warm chat is never re-read.
+_history_cache: LRUCache[int, tuple[list[HistoryTurn], int]] = LRUCache(
+    HISTORY_CACHE_MAX_ENTRIES, ttl=HISTORY_CACHE_TTL_SECONDS
+)
+
+# Turns handed to save_turns_in_background, per chat, and the one writer task per chat
+# that drains them. Each drain writes everything queued so far in one upsert, so a
+# chat's writes never race each other and turns queued during an upsert share the
+# next one. Reads and clears of a chat's history wait for its writer first, so callers
+# always see their own writes.
+_queued_turns: dict[int, list[PendingTurn]] = {}
+_turn_writers: dict[int, asyncio.Task[None]] = {}
+# One past the last turn_index handed out per chat. Indices are reserved before the AI
+# call and written later, so the stored maximum alone can't keep concurrent messages
+# of one chat apart; reservations take the larger of the two. Bounded like the other
+# per-chat caches; an entry only matters while a chat has writes in flight, and the
+# least recently used chats are the ones evicted.
+_TURN_INDEX_COUNTERS_MAX_ENTRIES = 10_000
+_next_reserved_turn_index: LRUCache[int, int] = LRUCache(
+    _TURN_INDEX_COUNTERS_MAX_ENTRIES
+)
+# Cleared once PostgREST reports the get_user_bundle function as missing (the SQL from
+# the README was not run, or an older version without p_history_limit was); bundles
+# are then always fetched with two queries.
+_user_bundle_rpc_available: bool = True
+# Likewise for the increment_message_count function; without it message counts are
+# written with a plain upsert.
+_increment_message_count_rpc_available: bool = True
 
 
 async def get_supabase_client() -> AsyncClient | None:
@@ -29,42 +86,89 @@ async def get_supabase_client() -> AsyncClient | None:
     Assumes database tables are already created.
     """
     global _cached_supabase_client
-    if _cached_supabase_client is None:
-        logger.info("Initializing ASYNC Supabase client...")
-        if not SUPABASE_URL or not SUPABASE_KEY:
-            logger.critical(
-                "SUPABASE_URL or SUPABASE_KEY environment variables not set."
-            )
-            return None
-        try:
-            start_time = time()
-            _cached_supabase_client = await create_async_client(
-                SUPABASE_URL,
-                SUPABASE_KEY,
-                options=AsyncClientOptions(postgrest_client_timeout=10),
-            )
-            init_time = time() - start_time
-            logger.info(
-                f"ASYNC Supabase client initialized successfully in {init_time:.4f} seconds."
-            )
+    if _cached_supabase_client is not None:
+        return _cached_supabase_client
+    async with _supabase_client_lock:
+        if _cached_supabase_client is None:
+            logger.info("Initializing ASYNC Supabase client...")
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                logger.critical(
+                    "SUPABASE_URL or SUPABASE_KEY environment variables not set."
+                )
+                return None
+            try:
+                start_time = perf_counter()
+                _cached_supabase_client = await create_async_client(
+                    SUPABASE_URL,
+                    SUPABASE_KEY,
+                    options=AsyncClientOptions(postgrest_client_timeout=10),
+                )
+                init_time = perf_counter() - start_time
+                logger.info(
+                    f"ASYNC Supabase client initialized successfully in {init_time:.4f} seconds."
+                )
 
-        except Exception as e:
-            logger.critical(
-                f"Failed to initialize ASYNC Supabase client: {e}", exc_info=True
-            )
-            _cached_supabase_client = None
+            except Exception as e:
+                logger.critical(
+                    f"Failed to initialize ASYNC Supabase client: {e}", exc_info=True
+                )
+                _cached_supabase_client = None
     return _cached_supabase_client
 
 
+def _settings_from_row(chat_id: int, row: dict[str, Any] | None) -> UserSettings:
+    """Builds UserSettings from a user_settings row, or defaults when there is none."""
+    if row:
+        settings: UserSettings = {
+            "gemini_api_key": row.get("gemini_api_key"),
+            "selected_model": row.get("selected_model", DEFAULT_MODEL_NAME),
+            "message_count": row.get("message_count", 0),
+        }
+        logger.debug("Fetched settings: %s", settings)
+        return settings
+    logger.info(
+        f"No settings found for {chat_id} in Supabase, returning defaults (async)."
+    )
+    return {
+        "gemini_api_key": None,
+        "selected_model": DEFAULT_MODEL_NAME,
+        "message_count": 0,
+    }
+
+
+def _get_cached_user_settings(chat_id: int) -> UserSettings | None:
+    if USER_SETTINGS_CACHE_TTL_SECONDS <= 0:
+        return None
+    settings = _user_settings_cache.get(chat_id)
+    lookups = _user_settings_cache.hits + _user_settings_cache.misses
+    if lookups % _SETTINGS_CACHE_STATS_LOG_EVERY == 0:
+        logger.info(
+            f"User settings cache: {_user_settings_cache.hits} hits, "
+            f"{_user_settings_cache.misses} misses, {len(_user_settings_cache)} entries."
+        )
+    # Hand out copies so callers can never mutate the cached entry.
+    return settings.copy() if settings is not None else None
+
+
+def _cache_user_settings(chat_id: int, settings: UserSettings) -> None:
+    if USER_SETTINGS_CACHE_TTL_SECONDS > 0:
+        _user_settings_cache.set(chat_id, settings.copy())
+
+
 async def get_user_settings_from_db(chat_id: int) -> UserSettings | None:
-    """Fetches user settings from the database using Supabase (async)."""
+    """Fetches user settings from the database using Supabase (async, cached)."""
+    cached_settings = _get_cached_user_settings(chat_id)
+    if cached_settings is not None:
+        logger.debug("Using cached settings for %s.", chat_id)
+        return cached_settings
+
     logger.info(f"Fetching settings for {chat_id} from Supabase (async)...")
     supabase_client = await get_supabase_client()
     if not supabase_client:
         logger.error("get_user_settings_from_db failed: Supabase client not available.")
         return None
 
-    start_time = time()
+    start_time = perf_counter()
     try:
         response = await (
             supabase_client.table("user_settings")
@@ -72,31 +176,16 @@ async def get_user_settings_from_db(chat_id: int) -> UserSettings | None:
             .eq("chat_id", chat_id)
             .execute()
         )
-        end_time = time() - start_time
+        end_time = perf_counter() - start_time
         logger.info(
             f"Fetched settings for {chat_id} in {end_time:.4f} seconds (async)."
         )
 
-        if response.data and len(response.data) > 0:
-            settings_data = response.data[0]
-            settings: UserSettings = {
-                "gemini_api_key": settings_data.get("gemini_api_key"),
-                "selected_model": settings_data.get(
-                    "selected_model", DEFAULT_MODEL_NAME
-                ),
-                "message_count": settings_data.get("message_count", 0),
-            }
-            logger.debug(f"Fetched settings: {settings}")
-            return settings
-        else:
-            logger.info(
-                f"No settings found for {chat_id} in Supabase, returning defaults (async)."
-            )
-            return {
-                "gemini_api_key": None,
-                "selected_model": DEFAULT_MODEL_NAME,
-                "message_count": 0,
-            }
+        settings = _settings_from_row(
+            chat_id, response.data[0] if response.data else None
+        )
+        _cache_user_settings(chat_id, settings)
+        return settings
     except Exception as e:
         logger.error(
             f"Error fetching settings for {chat_id} from Supabase (async): {e}",
@@ -115,7 +204,7 @@ async def save_user_settings_to_db(
         logger.error("Cannot save settings, Supabase client not available.")
         return False
 
-    start_time = time()
+    start_time = perf_counter()
     try:
         final_data_to_save: UserSettingsTableRowUpsert = {
             "chat_id": chat_id,
@@ -124,16 +213,22 @@ async def save_user_settings_to_db(
             "message_count": message_count,  # Add message_count here
         }
 
-        response = await (
-            supabase_client.table("user_settings").upsert(final_data_to_save).execute()
-        )
-        end_time = time() - start_time
+        try:
+            response = await (
+                supabase_client.table("user_settings")
+                .upsert(final_data_to_save)
+                .execute()
+            )
+        finally:
+            # Whatever the outcome, the cached copy can no longer be trusted.
+            _user_settings_cache.pop(chat_id)
+        end_time = perf_counter() - start_time
         logger.info(
             f"Saved settings for {chat_id} to Supabase in {end_time:.4f} seconds (async)."
         )
 
         if response.data:
-            logger.debug(f"Supabase upsert response data: {response.data}")
+            logger.debug("Supabase upsert response data: %s", response.data)
             return True
         elif hasattr(response, "error") and response.error:
             logger.error(
@@ -153,277 +248,595 @@ async def save_user_settings_to_db(
         return False
 
 
+async def increment_message_count_in_db(
+    chat_id: int, limit: int, model_name: str
+) -> int | None:
+    """Atomically counts one default-key message for a chat (async).
+
+    Uses the increment_message_count RPC, which only increments while the count is
+    below limit. Returns the new count, 0 if the limit was already reached, or None
+    if the function is not installed (callers then fall back to an upsert). Any other
+    failure is re-raised: the increment may or may not have been applied, so a
+    non-atomic retry could count the message twice or reopen the race.
+    """
+    global _increment_message_count_rpc_available
+    if not _increment_message_count_rpc_available:
+        return None
+
+    supabase_client = await get_supabase_client()
+    if not supabase_client:
+        logger.error("Cannot increment message count, Supabase client not available.")
+        raise RuntimeError("Supabase client not available")
+
+    start_time = perf_counter()
+    try:
+        try:
+            response = await supabase_client.rpc(
+                "increment_message_count",
+                {
+                    "p_chat_id": chat_id,
+                    "p_limit": limit,
+                    "p_selected_model": model_name,
+                },
+            ).execute()
+        finally:
+            _user_settings_cache.pop(chat_id)
+        end_time = perf_counter() - start_time
+        logger.info(
+            f"Incremented message count for {chat_id} via RPC in {end_time:.4f} seconds (async)."
+        )
+        return int(response.data or 0)
+    except Exception as e:
+        if getattr(e, "code", None) != "PGRST202":
+            logger.error(
+                f"increment_message_count RPC failed for {chat_id} (async): {e}",
+                exc_info=True,
+            )
+            raise
+        _increment_message_count_rpc_available = False
+        logger.warning(
+            f"increment_message_count RPC is not installed, falling back to an upsert: {e}"
+        )
+        return None
+
+
+def _text_part_from_dict(p_dict: SerializedPart) -> genai_types.Part | None:
+    if "text" not in p_dict:
+        return None
+    return genai_types.Part(text=str(p_dict["text"]))
+
+
+@functools.lru_cache(maxsize=16)
+def _image_placeholder(mime_type: str) -> str:
+    # A handful of mime types cover nearly every stored image.
+    return f"[Image: {mime_type}]"
+
+
+def _image_part_from_dict(p_dict: SerializedPart) -> genai_types.Part:
+    # Only a placeholder is stored for images; a caption is saved as its own text part.
+    return genai_types.Part(text=_image_placeholder(p_dict.get("mime_type", "image")))
+
+
+def _function_call_part_from_dict(p_dict: SerializedPart) -> genai_types.Part | None:
+    fc_data = p_dict.get("function_call")
+    if not isinstance(fc_data, dict):
+        return None
+    return genai_types.Part(
+        function_call=genai_types.FunctionCall(
+            name=str(fc_data.get("name")), args=fc_data.get("args")
+        )
+    )
+
+
+def _function_response_part_from_dict(
+    p_dict: SerializedPart,
+) -> genai_types.Part | None:
+    fr_data = p_dict.get("function_response")
+    if not isinstance(fr_data, dict):
+        return None
+    return genai_types.Part(
+        function_response=genai_types.FunctionResponse(
+            name=str(fr_data.get("name")), response=fr_data.get("response")
+        )
+    )
+
+
+# Rebuilds a Part from a stored parts_json entry, keyed by its "type". Types without
+# a builder (e.g. "file_data") are skipped.
+_PART_BUILDERS: dict[str, Callable[[SerializedPart], genai_types.Part | None]] = {
+    "text": _text_part_from_dict,
+    "image": _image_part_from_dict,
+    "function_call": _function_call_part_from_dict,
+    "function_response": _function_response_part_from_dict,
+}
+_HISTORY_ROLES = frozenset(("user", "model"))
+
+
+def _history_from_rows(chat_id: int, rows: list[dict[str, Any]]) -> list[HistoryTurn]:
+    """Rebuilds Content turns from chat_history rows ordered by turn_index."""
+    history: list[HistoryTurn] = []
+    if rows:
+        for row_idx, row in enumerate(rows):
+            role = row.get("role")
+            parts_data_raw = row.get("parts_json")
+            turn_index_from_db = row.get("turn_index", f"unknown_row_{row_idx}")
+            parts_data_intermediate: list[SerializedPart] | None = None
+
+            # Rows written by older versions hold the parts as a JSON-encoded
+            # string; current rows come back from JSONB as a list already.
+            if isinstance(parts_data_raw, str):
+                try:
+                    loaded_json = _json_loads(parts_data_raw)
+                    if isinstance(loaded_json, list) and all(
+                        isinstance(item, dict) for item in loaded_json
+                    ):
+                        parts_data_intermediate = loaded_json  # type: ignore
+                    else:
+                        logger.warning(
+                            f"Decoded parts_json for chat {chat_id}, turn {turn_index_from_db} is not a list of dicts: {type(loaded_json)}"
+                        )
+                except ValueError:
+                    logger.error(
+                        f"Failed to decode parts_json string for chat {chat_id}, turn {turn_index_from_db}."
+                    )
+                    continue
+            elif isinstance(parts_data_raw, list) and all(
+                isinstance(item, dict) for item in parts_data_raw
+            ):
+                parts_data_intermediate = parts_data_raw  # type: ignore
+            elif parts_data_raw is None:
+                logger.debug(
+                    "parts_json for chat %s, turn %s is None. Assuming empty parts.",
+                    chat_id,
+                    turn_index_from_db,
+                )
+                parts_data_intermediate = []
+            else:
+                logger.warning(
+                    f"parts_json for chat {chat_id}, turn {turn_index_from_db} is of unexpected type or structure: {type(parts_data_raw)}. Skipping."
+                )
+                continue
+
+            if role is not None and parts_data_intermediate is not None:
+                if role not in _HISTORY_ROLES:
+                    logger.warning(
+                        f"Skipping history row for {chat_id}, turn {turn_index_from_db} with unsupported role '{role}'."
+                    )
+                    continue
+                reconstructed_parts: list[genai_types.Part] = []
+                for p_dict in parts_data_intermediate:
+                    build_part = _PART_BUILDERS.get(p_dict.get("type", ""))
+                    part = build_part(p_dict) if build_part is not None else None
+                    if part is not None:
+                        reconstructed_parts.append(part)
+                history.append(
+                    genai_types.Content(role=role, parts=reconstructed_parts)
+                )
+            elif role is None:
+                logger.warning(
+                    f"Skipping turn for {chat_id}, turn_index {turn_index_from_db} due to missing role."
+                )
+
+    if MAX_HISTORY_LENGTH_TURNS > 0 and len(history) > MAX_HISTORY_LENGTH_TURNS:
+        logger.info(
+            f"History length {len(history)} exceeds MAX_HISTORY_LENGTH_TURNS {MAX_HISTORY_LENGTH_TURNS} for {chat_id}. Truncating (async)."
+        )
+        history = history[-MAX_HISTORY_LENGTH_TURNS:]
+    return history
+
+
+def _next_turn_index_from_rows(rows: list[dict[str, Any]]) -> int:
+    turn_indices = [
+        row["turn_index"] for row in rows if isinstance(row.get("turn_index"), int)
+    ]
+    return max(turn_indices) + 1 if turn_indices else 0
+
+
+def _get_cached_history(chat_id: int) -> tuple[list[HistoryTurn], int] | None:
+    if HISTORY_CACHE_TTL_SECONDS <= 0:
+        return None
+    entry = _history_cache.get(chat_id)
+    if entry is None:
+        return None
+    history, next_turn_index = entry
+    # A new list, so callers can never change the cached entry.
+    return list(history), next_turn_index
+
+
+def _cache_history(
+    chat_id: int, history: list[HistoryTurn], next_turn_index: int
+) -> None:
+    if HISTORY_CACHE_TTL_SECONDS > 0:
+        _history_cache.set(chat_id, (list(history), next_turn_index))
+
+
+def _append_to_cached_history(chat_id: int, rows: list[dict[str, Any]]) -> None:
+    """Adds freshly saved chat_history rows to the chat's cached history, if any."""
+    entry = _history_cache.get(chat_id)
+    if entry is None:
+        return
+    history, next_turn_index = entry
+    if min(row["turn_index"] for row in rows) < next_turn_index:
+        # An existing turn was overwritten; reload from the database on next read.
+        _history_cache.pop(chat_id)
+        return
+    history = history + _history_from_rows(chat_id, rows)
+    if MAX_HISTORY_LENGTH_TURNS > 0:
+        history = history[-MAX_HISTORY_LENGTH_TURNS:]
+    _history_cache.set(chat_id, (history, _next_turn_index_from_rows(rows)))
+
+
 async def get_history_from_db(chat_id: int) -> list[HistoryTurn] | None:
-    """Fetches chat history content for a user from Supabase (async)."""
+    """Fetches chat history content for a user from Supabase (async, cached)."""
+    await wait_for_pending_turn_saves(chat_id)
+    cached_history = _get_cached_history(chat_id)
+    if cached_history is not None:
+        logger.debug("Using cached history for %s.", chat_id)
+        return cached_history[0]
+
     logger.info(f"Fetching history for {chat_id} from Supabase (async)...")
     supabase_client = await get_supabase_client()
     if not supabase_client:
         logger.error("get_history_from_db failed: Supabase client not available.")
         return None
 
-    start_time = time()
+    start_time = perf_counter()
     try:
-        response = await (
+        # Only the newest MAX_HISTORY_LENGTH_TURNS rows are used, so let Postgres pick
+        # them (a backward scan of the primary key) and restore oldest-first order here.
+        query = (
             supabase_client.table("chat_history")
             .select("role, parts_json, turn_index")
             .eq("chat_id", chat_id)
-            .order("turn_index")
-            .execute()
+            .order("turn_index", desc=True)
         )
-        end_time = time() - start_time
+        if MAX_HISTORY_LENGTH_TURNS > 0:
+            query = query.limit(MAX_HISTORY_LENGTH_TURNS)
+        response = await query.execute()
+        end_time = perf_counter() - start_time
         logger.info(
             f"Fetched history for {chat_id} in {end_time:.4f} seconds ({len(response.data or [])} rows) (async)."
         )
 
-        history: list[HistoryTurn] = []
-        if response.data:
-            for row_idx, row in enumerate(response.data):
-                role = row.get("role")
-                parts_data_raw = row.get("parts_json")
-                turn_index_from_db = row.get("turn_index", f"unknown_row_{row_idx}")
-                parts_data_intermediate: list[SerializedPart] | None = None
-
-                if isinstance(parts_data_raw, str):
-                    try:
-                        loaded_json = json.loads(parts_data_raw)
-                        if isinstance(loaded_json, list) and all(
-                            isinstance(item, dict) for item in loaded_json
-                        ):
-                            parts_data_intermediate = loaded_json  # type: ignore
-                        else:
-                            logger.warning(
-                                f"Decoded parts_json for chat {chat_id}, turn {turn_index_from_db} is not a list of dicts: {type(loaded_json)}"
-                            )
-                    except json.JSONDecodeError:
-                        logger.error(
-                            f"Failed to decode parts_json string for chat {chat_id}, turn {turn_index_from_db}."
-                        )
-                        continue
-                elif isinstance(parts_data_raw, list) and all(
-                    isinstance(item, dict) for item in parts_data_raw
-                ):
-                    parts_data_intermediate = parts_data_raw  # type: ignore
-                elif parts_data_raw is None:
-                    logger.debug(
-                        f"parts_json for chat {chat_id}, turn {turn_index_from_db} is None. Assuming empty parts."
-                    )
-                    parts_data_intermediate = []
-                else:
-                    logger.warning(
-                        f"parts_json for chat {chat_id}, turn {turn_index_from_db} is of unexpected type or structure: {type(parts_data_raw)}. Skipping."
-                    )
-                    continue
+        rows = (response.data or [])[::-1]
+        history = _history_from_rows(chat_id, rows)
+        _cache_history(chat_id, history, _next_turn_index_from_rows(rows))
+        return history
+    except Exception as e:
+        logger.error(
+            f"Error fetching or reconstructing history for {chat_id} from Supabase (async): {e}",
+            exc_info=True,
+        )
+        return None
 
-                if role is not None and parts_data_intermediate is not None:
-                    reconstructed_parts: list[genai_types.Part] = []
-                    for p_dict_typed in parts_data_intermediate:
-                        p_dict: SerializedPart = p_dict_typed
-                        part_type = p_dict.get("type")
-                        if part_type == "text" and "text" in p_dict:
-                            reconstructed_parts.append(
-                                genai_types.Part(text=str(p_dict["text"]))
-                            )
-                        elif part_type == "image":
-                            # Image reconstruction for DB stored data might be simplified
-                            # The current code stores a placeholder text.
-                            image_text = f"[Image: {p_dict.get('mime_type', 'image')}]"
-                            # Caption is not stored in p_dict for 'image' type, it's a separate text part.
-                            reconstructed_parts.append(
-                                genai_types.Part(text=image_text)
-                            )
-                        elif part_type == "function_call" and "function_call" in p_dict:
-                            fc_data = p_dict.get("function_call")
-                            if isinstance(fc_data, dict):
-                                reconstructed_parts.append(
-                                    genai_types.Part(
-                                        function_call=genai_types.FunctionCall(
-                                            name=str(fc_data.get("name")),
-                                            args=fc_data.get("args"),
-                                        )
-                                    )
-                                )
-                        elif (
-                            part_type == "function_response"
-                            and "function_response" in p_dict
-                        ):
-                            fr_data = p_dict.get("function_response")
-                            if isinstance(
-                                fr_data, dict
-                            ):  # fr_data is SerializedFunctionResponse
-                                reconstructed_parts.append(
-                                    genai_types.Part(
-                                        function_response=genai_types.FunctionResponse(
-                                            name=str(fr_data.get("name")),
-                                            response=fr_data.get("response"),
-                                        )
-                                    )
-                                )
-                    if role in ["user", "model"]:
-                        history.append(
-                            genai_types.Content(role=role, parts=reconstructed_parts)
-                        )
-                    else:
-                        logger.warning(
-                            f"Skipping history row for {chat_id}, turn {turn_index_from_db} with unsupported role '{role}'."
-                        )
-                elif role is None:
-                    logger.warning(
-                        f"Skipping turn for {chat_id}, turn_index {turn_index_from_db} due to missing role."
-                    )
 
-        if MAX_HISTORY_LENGTH_TURNS > 0 and len(history) > MAX_HISTORY_LENGTH_TURNS:
+async def get_user_bundle_from_db(chat_id: int) -> tuple[UserSettings, int] | None:
+    """Fetches user settings and the chat's next turn_index together (async).
+
+    Uses the get_user_bundle RPC (one round-trip) when it exists in the database,
+    otherwise runs the settings and turn_index queries concurrently. The history itself
+    is not loaded: the agent keeps the conversation in its session and reads older turns
+    through the get_chat_history tool, so a message only needs to know where its turns go.
+    """
+    global _user_bundle_rpc_available
+    await wait_for_pending_turn_saves(chat_id)
+    cached_history = _get_cached_history(chat_id)
+    if cached_history is not None:
+        logger.debug("Using cached history for %s.", chat_id)
+        settings = await get_user_settings_from_db(chat_id)
+        if settings is None:
+            return None
+        return settings, cached_history[1]
+
+    logger.info(
+        f"Fetching settings and next turn index for {chat_id} from Supabase (async)..."
+    )
+    supabase_client = await get_supabase_client()
+    if not supabase_client:
+        logger.error("get_user_bundle_from_db failed: Supabase client not available.")
+        return None
+
+    if _user_bundle_rpc_available:
+        start_time = perf_counter()
+        try:
+            # Only the newest row is needed for its turn_index, so the RPC is asked
+            # for a single history row instead of the whole window.
+            response = await supabase_client.rpc(
+                "get_user_bundle", {"p_chat_id": chat_id, "p_history_limit": 1}
+            ).execute()
+            end_time = perf_counter() - start_time
+            bundle = response.data or {}
             logger.info(
-                f"History length {len(history)} exceeds MAX_HISTORY_LENGTH_TURNS {MAX_HISTORY_LENGTH_TURNS} for {chat_id}. Truncating (async)."
+                f"Fetched settings and next turn index for {chat_id} via RPC in {end_time:.4f} seconds (async)."
             )
-            history = history[-MAX_HISTORY_LENGTH_TURNS:]
-        return history
+            settings = _settings_from_row(chat_id, bundle.get("settings"))
+            _cache_user_settings(chat_id, settings)
+            return settings, _next_turn_index_from_rows(bundle.get("history") or [])
+        except Exception as e:
+            if getattr(e, "code", None) == "PGRST202":
+                _user_bundle_rpc_available = False
+            logger.warning(
+                f"get_user_bundle RPC failed for {chat_id}, falling back to separate queries: {e}"
+            )
+
+    settings, next_turn_index = await asyncio.gather(
+        get_user_settings_from_db(chat_id), get_next_turn_index(chat_id)
+    )
+    if settings is None or next_turn_index is None:
+        return None
+    return settings, next_turn_index
+
+
+async def get_next_turn_index(chat_id: int) -> int | None:
+    """Returns the turn_index the next saved turn of a chat should use (async).
+
+    This is one past the highest stored index, which is not the length of the history
+    once a chat grows past MAX_HISTORY_LENGTH_TURNS and the history is truncated.
+    """
+    await wait_for_pending_turn_saves(chat_id)
+    cached_history = _get_cached_history(chat_id)
+    if cached_history is not None:
+        return cached_history[1]
+
+    supabase_client = await get_supabase_client()
+    if not supabase_client:
+        logger.error("get_next_turn_index failed: Supabase client not available.")
+        return None
+    try:
+        response = await (
+            supabase_client.table("chat_history")
+            .select("turn_index")
+            .eq("chat_id", chat_id)
+            .order("turn_index", desc=True)
+            .limit(1)
+            .execute()
+        )
+        return _next_turn_index_from_rows(response.data or [])
     except Exception as e:
         logger.error(
-            f"Error fetching or reconstructing history for {chat_id} from Supabase (async): {e}",
+            f"Error fetching the last turn index for {chat_id} from Supabase (async): {e}",
             exc_info=True,
         )
         return None
 
 
-async def save_turn_to_db(
+def reserve_turn_indices(chat_id: int, count: int, stored_next_index: int) -> int:
+    """Reserves count consecutive turn_index values for a chat.
+
+    stored_next_index is the next free index according to the database (see
+    get_user_bundle_from_db). It may be stale if another message of the chat reserved
+    indices after it was read; the per-chat counter covers that case. Returns the
+    first reserved index.
+    """
+    first_index = max(stored_next_index, _next_reserved_turn_index.get(chat_id) or 0)
+    _next_reserved_turn_index.set(chat_id, first_index + count)
+    return first_index
+
+
+def _serialize_parts(
     chat_id: int,
     turn_index: int,
     role: str | None,
     parts: list[genai_types.Part] | None,
-) -> bool:
-    """Saves a user or model turn to chat_history using Supabase (UPSERTs, async)."""
-    logger.info(
-        f"Saving turn {turn_index} for {chat_id} ({role}) to Supabase (async)..."
-    )
-    supabase_client = await get_supabase_client()
-    if not supabase_client:
-        logger.error("Cannot save turn, Supabase client not available.")
-        return False
-
-    start_time = time()
+) -> list[SerializedPart]:
+    """Converts a turn's Parts into the dicts stored in chat_history.parts_json."""
     parts_data_to_save: list[SerializedPart] = []
 
     if parts is not None:
         logger.debug(
-            f"save_turn_to_db: chat_id={chat_id}, turn_index={turn_index}, role={role}, received parts: {parts}"
+            "_serialize_parts: chat_id=%s, turn_index=%s, role=%s, received parts: %s",
+            chat_id,
+            turn_index,
+            role,
+            parts,
         )
         for i, part_object in enumerate(parts):
-            logger.debug(f"Processing part {i}: {part_object}")
+            logger.debug("Processing part %s: %s", i, part_object)
             part_dict: SerializedPart | None = None
-            if hasattr(part_object, "text") and part_object.text is not None:
-                logger.debug(f"Part {i} has text: '{part_object.text}'")
-                part_dict = SerializedPart(type="text", text=part_object.text)
-            elif (
-                hasattr(part_object, "inline_data")
-                and part_object.inline_data is not None
-            ):
+            # getattr with a default rather than hasattr + attribute access: one
+            # lookup per field, and hasattr would also swallow unrelated errors.
+            text = getattr(part_object, "text", None)
+            if text is not None:
+                logger.debug("Part %s has text: '%s'", i, text)
+                part_dict = SerializedPart(type="text", text=text)
+            elif (inline_data := getattr(part_object, "inline_data", None)) is not None:
                 logger.debug(
-                    f"Part {i} has inline_data: mime_type='{part_object.inline_data.mime_type}'"
+                    "Part %s has inline_data: mime_type='%s'", i, inline_data.mime_type
                 )
                 part_dict = SerializedPart(
                     type="image",  # Assuming inline_data is for images for now
-                    mime_type=part_object.inline_data.mime_type
+                    mime_type=inline_data.mime_type
                     or "image/png",  # Provide a fallback
-                    data_placeholder=f"Inline data ({part_object.inline_data.mime_type or 'unknown_mime_type'})",
+                    data_placeholder=f"Inline data ({inline_data.mime_type or 'unknown_mime_type'})",
                 )
             elif (
-                hasattr(part_object, "function_response")
-                and part_object.function_response is not None
-            ):
+                function_response := getattr(part_object, "function_response", None)
+            ) is not None:
                 logger.debug(
-                    f"Part {i} has function_response: name='{part_object.function_response.name}'"
+                    "Part %s has function_response: name='%s'",
+                    i,
+                    function_response.name,
                 )
                 part_dict = SerializedPart(
                     type="function_response",
                     function_response={
-                        "name": part_object.function_response.name or "",
-                        "response": part_object.function_response.response or {},
+                        "name": function_response.name or "",
+                        "response": function_response.response or {},
                     },
                 )
             elif (
-                hasattr(part_object, "function_call")
-                and part_object.function_call is not None
-            ):
+                function_call := getattr(part_object, "function_call", None)
+            ) is not None:
                 logger.debug(
-                    f"Part {i} has function_call: name='{part_object.function_call.name}'"
+                    "Part %s has function_call: name='%s'", i, function_call.name
                 )
                 part_dict = SerializedPart(
                     type="function_call",
                     function_call={
-                        "name": part_object.function_call.name or "",
-                        "args": part_object.function_call.args or {},
+                        "name": function_call.name or "",
+                        "args": function_call.args or {},
                     },
                 )
 
             if part_dict:
                 parts_data_to_save.append(part_dict)
-                logger.debug(f"Part {i} serialized to: {part_dict}")
+                logger.debug("Part %s serialized to: %s", i, part_dict)
             else:
                 logger.warning(
                     f"Turn {turn_index} for chat {chat_id}, part {i} couldn't be serialized to known types. Part content: {part_object}"
                 )
     else:
         logger.debug(
-            f"save_turn_to_db: chat_id={chat_id}, turn_index={turn_index}, role={role}, input parts list was None. Saving with empty parts_json."
+            "_serialize_parts: chat_id=%s, turn_index=%s, role=%s, input parts list was None. Saving with empty parts_json.",
+            chat_id,
+            turn_index,
+            role,
         )
+    return parts_data_to_save
 
-    parts_json_to_store = json.dumps(parts_data_to_save)
-    logger.debug(
-        f"Storing parts_json for turn {turn_index}, chat {chat_id} ({role}): {parts_json_to_store}"
-    )
 
-    try:
-        data_to_save = {
+async def save_turns_to_db(chat_id: int, turns: list[PendingTurn]) -> bool:
+    """Saves several turns of one chat to chat_history in a single upsert (async)."""
+    if not turns:
+        return True
+    turn_indices = ", ".join(str(turn_index) for turn_index, _, _ in turns)
+    # Indices are reserved per message, so a repeat means two turns would overwrite
+    # each other (and one upsert can't touch the same row twice).
+    if len({turn_index for turn_index, _, _ in turns}) != len(turns):
+        logger.error(f"Refusing to save duplicate turns {turn_indices} for {chat_id}.")
+        raise ValueError(f"Duplicate turn_index in turns {turn_indices} for {chat_id}")
+    logger.info(f"Saving turns {turn_indices} for {chat_id} to Supabase (async)...")
+    supabase_client = await get_supabase_client()
+    if not supabase_client:
+        logger.error("Cannot save turns, Supabase client not available.")
+        return False
+
+    start_time = perf_counter()
+    # parts_json is a JSONB column: send the list itself so it is stored as a JSON
+    # array (one encode by the client) rather than a JSON-encoded string scalar.
+    data_to_save = [
+        {
             "chat_id": chat_id,
             "turn_index": turn_index,
             "role": role,
-            "parts_json": parts_json_to_store,
+            "parts_json": _serialize_parts(chat_id, turn_index, role, parts),
         }
+        for turn_index, role, parts in turns
+    ]
+    logger.debug("Storing chat_history rows for %s: %s", chat_id, data_to_save)
+
+    try:
+        # PostgREST upserts a JSON array of rows in one statement.
         response = (
             await supabase_client.table("chat_history").upsert(data_to_save).execute()
         )
-        end_time = time() - start_time
+        end_time = perf_counter() - start_time
         logger.info(
-            f"Saved turn {turn_index} for {chat_id} ({role}) to Supabase in {end_time:.4f} seconds (async)."
+            f"Saved turns {turn_indices} for {chat_id} to Supabase in {end_time:.4f} seconds (async)."
         )
 
         if response.data:
+            _append_to_cached_history(chat_id, data_to_save)
             return True
         elif hasattr(response, "error") and response.error:
             logger.error(
-                f"Supabase upsert error for turn {turn_index}, chat {chat_id} (async): {response.error}"
+                f"Supabase upsert error for turns {turn_indices}, chat {chat_id} (async): {response.error}"
             )
+            _history_cache.pop(chat_id)
             return False
         else:
             logger.warning(
-                f"Supabase upsert for turn {turn_index}, chat {chat_id} returned no data but no error (async). Response: {response}"
+                f"Supabase upsert for turns {turn_indices}, chat {chat_id} returned no data but no error (async). Response: {response}"
             )
+            _append_to_cached_history(chat_id, data_to_save)
             return True
     except Exception as e:
         logger.error(
-            f"Error saving turn {turn_index} for {chat_id} ({role}) to Supabase (async): {e}",
+            f"Error saving turns {turn_indices} for {chat_id} to Supabase (async): {e}",
             exc_info=True,
         )
+        # The write may or may not have landed, so the cached copy can't be trusted.
+        _history_cache.pop(chat_id)
         return False
 
 
+async def save_turn_to_db(
+    chat_id: int,
+    turn_index: int,
+    role: str | None,
+    parts: list[genai_types.Part] | None,
+) -> bool:
+    """Saves a user or model turn to chat_history using Supabase (UPSERTs, async)."""
+    return await save_turns_to_db(chat_id, [(turn_index, role, parts)])
+
+
+def save_turns_in_background(
+    chat_id: int, turns: list[PendingTurn]
+) -> asyncio.Task[None]:
+    """Queues turns for the chat's background writer so the caller does not wait.
+
+    Failures are logged by the writer. Later history reads and clears for the same chat
+    wait for it, so ordering with respect to this process's own reads is preserved.
+    """
+    _queued_turns.setdefault(chat_id, []).extend(turns)
+    writer = _turn_writers.get(chat_id)
+    if writer is None:
+        writer = asyncio.create_task(_write_queued_turns(chat_id))
+        _turn_writers[chat_id] = writer
+    return writer
+
+
+async def _write_queued_turns(chat_id: int) -> None:
+    try:
+        while turns := _queued_turns.pop(chat_id, None):
+            try:
+                saved = await save_turns_to_db(chat_id, turns)
+            except ValueError:
+                saved = False
+            if not saved:
+                turn_indices = ", ".join(str(turn_index) for turn_index, _, _ in turns)
+                logger.error(
+                    f"Background save of turns {turn_indices} failed for {chat_id}."
+                )
+    finally:
+        # No await between the final empty pop and here, so nothing can be queued
+        # without a writer; anything left after a cancellation starts a new one.
+        _turn_writers.pop(chat_id, None)
+
+
+async def wait_for_pending_turn_saves(chat_id: int | None = None) -> None:
+    """Waits for background turn saves of one chat, or of all chats if chat_id is None."""
+    if chat_id is None:
+        writers = list(_turn_writers.values())
+    else:
+        writer = _turn_writers.get(chat_id)
+        writers = [writer] if writer is not None else []
+    if writers:
+        await asyncio.gather(*writers, return_exceptions=True)
+
+
 async def clear_history_in_db(chat_id: int) -> bool:
     """Clears chat history for a user in Supabase (async)."""
+    # A save still in flight would otherwise land after the delete.
+    await wait_for_pending_turn_saves(chat_id)
     logger.info(f"Clearing history for {chat_id} in Supabase (async)...")
     supabase_client = await get_supabase_client()
     if not supabase_client:
         logger.error("Cannot clear history, Supabase client not available.")
         return False
 
-    start_time = time()
+    start_time = perf_counter()
     try:
-        response = await (
-            supabase_client.table("chat_history")
-            .delete()
-            .eq("chat_id", chat_id)
-            .execute()
-        )
-        end_time = time() - start_time
+        try:
+            response = await (
+                supabase_client.table("chat_history")
+                .delete()
+                .eq("chat_id", chat_id)
+                .execute()
+            )
+        finally:
+            _history_cache.pop(chat_id)
+        end_time = perf_counter() - start_time
         logger.info(
             f"Cleared history for {chat_id} in Supabase in {end_time:.4f} seconds (async). Response data: {response.data}"
         )
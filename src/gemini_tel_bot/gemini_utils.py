@@ -1,14 +1,26 @@
 import logging
-from time import time
-from typing import Any
+import os
+import ssl
+from operator import itemgetter
+from time import perf_counter
 
+import certifi
+import httpx
 from google import genai
 from google.api_core.exceptions import ClientError as APICoreClientError
 from google.api_core.exceptions import PermissionDenied
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
 from google.genai.pagers import AsyncPager
 from google.genai.types import Model as GenAiModel
 
-from .config import GOOGLE_API_KEY
+from .cache import LRUCache, key_fingerprint
+from .config import (
+    GENAI_CLIENT_CACHE_MAX_ENTRIES,
+    GENAI_CLIENT_CACHE_TTL_SECONDS,
+    GOOGLE_API_KEY,
+    MODELS_CACHE_TTL_SECONDS,
+)
 from .custom_types import ModelInfo, UserSettings
 
 logger = logging.getLogger(__name__)
@@ -28,10 +40,44 @@ COMMON_MODELS_TO_SHOW = [
     # "gemma-3-27b-it",
     # "gemma-3n-e4b-it",
 ]
+_COMMON_MODELS_TO_SHOW_SET = frozenset(COMMON_MODELS_TO_SHOW)
 
-# Cache for genai.Client instances. Key is the API key string.
+# google-genai builds a fresh SSL context (re-reading the CA bundle) and unbounded
+# connection pools for every Client unless told otherwise. All clients created by the
+# bot share one context, and each keeps a small keep-alive pool so repeated calls
+# with the same key reuse warm TLS connections.
+_shared_ssl_context = ssl.create_default_context(
+    cafile=os.environ.get("SSL_CERT_FILE", certifi.where()),
+    capath=os.environ.get("SSL_CERT_DIR"),
+)
+_GENAI_HTTP_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+_GENAI_HTTP_OPTIONS = genai_types.HttpOptions(
+    client_args={"verify": _shared_ssl_context, "limits": _GENAI_HTTP_LIMITS},
+    async_client_args={"verify": _shared_ssl_context, "limits": _GENAI_HTTP_LIMITS},
+)
+
+
+def new_genai_client(api_key: str) -> genai.Client:
+    """Creates a genai.Client using the bot's shared HTTP settings."""
+    return genai.Client(api_key=api_key, http_options=_GENAI_HTTP_OPTIONS)
+
+
+# Cache for genai.Client instances. Key is the fingerprint of the API key.
 # None value means client creation failed for that key and shouldn't be retried immediately.
-_cached_genai_clients: dict[str, genai.Client | None] = {}
+# Bounded so that many users with personal keys can't grow it forever; an evicted
+# client's httpx clients close themselves once it is garbage collected. Entries
+# expire after GENAI_CLIENT_CACHE_TTL_SECONDS so rotated or revoked keys (and failed
+# creations) are not served forever.
+_cached_genai_clients: LRUCache[bytes, genai.Client | None] = LRUCache(
+    GENAI_CLIENT_CACHE_MAX_ENTRIES,
+    ttl=GENAI_CLIENT_CACHE_TTL_SECONDS if GENAI_CLIENT_CACHE_TTL_SECONDS > 0 else None,
+)
+
+# Filtered model lists per API key fingerprint. The set of available models changes
+# rarely, so /list_models and /select_model reuse a listing for MODELS_CACHE_TTL_SECONDS.
+_models_cache: LRUCache[bytes, list[ModelInfo]] = LRUCache(
+    256, ttl=MODELS_CACHE_TTL_SECONDS
+)
 
 
 def _create_genai_client(api_key: str) -> genai.Client | None:
@@ -40,7 +86,7 @@ def _create_genai_client(api_key: str) -> genai.Client | None:
         logger.error("_create_genai_client called with an empty or None API key.")
         return None
     try:
-        client = genai.Client(api_key=api_key)
+        client = new_genai_client(api_key)
         logger.info(
             f"Successfully created genai.Client with API key ending ...{api_key[-4:] if len(api_key) > 3 else '****'}"
         )
@@ -76,17 +122,19 @@ def get_user_client(user_provided_api_key: str | None) -> genai.Client | None:
         )
         return None
 
-    # Check cache using the actual key string that will be used for client creation
-    if key_for_client_operations not in _cached_genai_clients:
+    # Check cache using the fingerprint of the key that will be used for client creation
+    cache_key = key_fingerprint(key_for_client_operations)
+    client = _cached_genai_clients.get(cache_key)
+    if client is None and cache_key not in _cached_genai_clients:
         logger.info(
             f"get_user_client: No cached client for {log_key_source_description}. Attempting to create."
         )
-        client_instance = _create_genai_client(key_for_client_operations)
-        _cached_genai_clients[key_for_client_operations] = (
-            client_instance  # Cache instance or None if creation failed
+        client = _create_genai_client(key_for_client_operations)
+        _cached_genai_clients.set(
+            cache_key,
+            client,  # Cache instance or None if creation failed
         )
 
-    client = _cached_genai_clients.get(key_for_client_operations)
     if client is None:
         # This means it was cached as None (creation failed previously) or key_for_client_operations was somehow not set (should be caught above)
         logger.warning(
@@ -95,12 +143,24 @@ def get_user_client(user_provided_api_key: str | None) -> genai.Client | None:
     return client
 
 
+def forget_cached_client(api_key: str | None) -> None:
+    """Drops the cached genai.Client for an API key so the next call builds a new one."""
+    if api_key:
+        _cached_genai_clients.pop(key_fingerprint(api_key))
+
+
+def forget_cached_models(api_key: str | None) -> None:
+    """Drops the cached model listing for an API key, e.g. once a user replaces it."""
+    if api_key:
+        _models_cache.pop(key_fingerprint(api_key))
+
+
 async def fetch_available_models_for_user(
     user_settings: UserSettings,
 ) -> list[ModelInfo] | None:
     """Fetches and filters available generative models for a user's API key asynchronously."""
     logger.info("Fetching available models asynchronously...")
-    start_time = time()
+    start_time = perf_counter()
     try:
         api_key_to_use = user_settings.get("gemini_api_key")
         if not api_key_to_use:
@@ -110,6 +170,16 @@ async def fetch_available_models_for_user(
             logger.warning("Cannot list models: No valid API key available for user.")
             return None
 
+        models_cache_key = key_fingerprint(api_key_to_use)
+        cached_models = (
+            _models_cache.get(models_cache_key)
+            if MODELS_CACHE_TTL_SECONDS > 0
+            else None
+        )
+        if cached_models is not None:
+            logger.info(f"Using {len(cached_models)} cached available models.")
+            return list(cached_models)
+
         client_for_user = get_user_client(api_key_to_use)
         if client_for_user is None:
             logger.warning(
@@ -118,71 +188,65 @@ async def fetch_available_models_for_user(
             return None
 
         logger.info("Calling client_for_user.aio.models.list()...")
-        list_start_time = time()
+        list_start_time = perf_counter()
 
         models_iterator: AsyncPager[GenAiModel] = (
             await client_for_user.aio.models.list()
         )
-        models_list_raw: list[GenAiModel] = []
-        async for model_obj in models_iterator:
-            models_list_raw.append(model_obj)
-
-        list_time = time() - list_start_time
-        logger.info(
-            f"client_for_user.aio.models.list() completed in {list_time:.4f} seconds. Found {len(models_list_raw)} raw models."
-        )
-
+        # Filter while paging instead of materializing the raw listing first.
+        raw_model_count = 0
         generative_models_info: list[ModelInfo] = []
         logger.debug("Filtering raw models:")
-        for m in models_list_raw:
-            model_name = getattr(
-                m, "name", ""
-            )  # Full name e.g., "models/gemini-1.5-pro-latest"
-            description = getattr(m, "description", "")
+        async for m in models_iterator:
+            raw_model_count += 1
+            # Full name e.g., "models/gemini-1.5-pro-latest"
+            model_name = getattr(m, "name", None) or ""
 
-            # Extract the base model name (e.g., "gemini-1.5-pro-latest")
-            base_model_name = model_name.split("/")[-1]
+            # Extract the base model name (e.g., "gemini-1.5-pro-latest") and check
+            # the curated set first: it rejects most models with one hash lookup.
+            base_model_name = model_name.rpartition("/")[2]
+            if base_model_name not in _COMMON_MODELS_TO_SHOW_SET:
+                continue
 
-            # Specific exclusions based on keywords in the full model name
-            is_embedding = "embedding" in model_name.lower()
-            is_aqa = "aqa" in model_name.lower()  # Attributed Question Answering models
-            is_tuned = model_name.startswith("tunedModels/")  # User-tuned models
-
-            # Check if the base model name is in our curated list and not an excluded type
+            # Specific exclusions: user-tuned, embedding and Attributed Question
+            # Answering models
+            model_name_lower = model_name.lower()
             if (
-                model_name
-                and base_model_name in COMMON_MODELS_TO_SHOW
-                and not is_embedding
-                and not is_aqa
-                and not is_tuned
+                model_name.startswith("tunedModels/")
+                or "embedding" in model_name_lower
+                or "aqa" in model_name_lower
             ):
-                logger.debug(
-                    f"  -> Keeping model from curated list: {model_name} (base: {base_model_name})"
-                )
-
-                model_info: ModelInfo = {
-                    "name": model_name,
-                    "description": description,
-                    "input_token_limit": getattr(m, "input_token_limit", None),
-                    "output_token_limit": getattr(m, "output_token_limit", None),
-                    "supported_actions": [],  # Default to empty list
-                }
-                actions = getattr(m, "supported_actions", None)
-                if actions:
-                    try:
-                        action_strings = [str(a) for a in actions if str(a)]
-                        model_info["supported_actions"] = action_strings
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to convert supported_actions to strings for {model_name}: {e}"
-                        )
-                        model_info["supported_actions"] = ["<Error converting actions>"]
-
-                generative_models_info.append(model_info)
-
-        generative_models_info.sort(key=lambda x: x["name"])
-
-        end_time = time() - start_time
+                continue
+
+            description = getattr(m, "description", "")
+            logger.debug(
+                f"  -> Keeping model from curated list: {model_name} (base: {base_model_name})"
+            )
+
+            model_info: ModelInfo = {
+                "name": model_name,
+                "description": description,
+                "input_token_limit": getattr(m, "input_token_limit", None),
+                "output_token_limit": getattr(m, "output_token_limit", None),
+                "supported_actions": [],  # Default to empty list
+            }
+            actions = getattr(m, "supported_actions", None)
+            if actions:
+                # The whole call is already guarded by the outer except below.
+                model_info["supported_actions"] = [a for a in map(str, actions) if a]
+
+            generative_models_info.append(model_info)
+
+        list_time = perf_counter() - list_start_time
+        logger.info(
+            f"client_for_user.aio.models.list() and filtering completed in {list_time:.4f} seconds. Kept {len(generative_models_info)} of {raw_model_count} raw models."
+        )
+
+        generative_models_info.sort(key=itemgetter("name"))
+        if MODELS_CACHE_TTL_SECONDS > 0:
+            _models_cache.set(models_cache_key, list(generative_models_info))
+
+        end_time = perf_counter() - start_time
         logger.info(
             f"Fetched, filtered, and sorted {len(generative_models_info)} available models in {end_time:.4f} seconds."
         )
@@ -190,9 +254,17 @@ async def fetch_available_models_for_user(
 
     except PermissionDenied as pd_e:
         logger.error(f"Permission denied when listing models: {pd_e}", exc_info=True)
+        # Don't keep serving a client for a key the API has just rejected.
+        forget_cached_client(api_key_to_use)
+        return None
+    except genai_errors.ClientError as ce:
+        logger.error(f"Client error when listing models: {ce}", exc_info=True)
+        # google-genai reports a rejected key as 401/403 (or 400 API_KEY_INVALID).
+        if ce.code in (401, 403) or "API_KEY_INVALID" in str(ce):
+            forget_cached_client(api_key_to_use)
         return None
     except Exception as e:
-        end_time = time() - start_time
+        end_time = perf_counter() - start_time
         logger.error(
             f"Error listing models after {end_time:.4f} seconds: {e}", exc_info=True
         )
@@ -1,9 +1,12 @@
+import asyncio
+import functools
 import logging
 
 from telebot import types as telebot_types
 from telebot.async_telebot import AsyncTeleBot
 from telegramify_markdown import standardize
 
+from .cache import LRUCache
 from .config import DEFAULT_KEY_MESSAGE_LIMIT, DEFAULT_MODEL_NAME, GOOGLE_API_KEY
 from .db import (
     clear_history_in_db,
@@ -11,19 +14,112 @@ from .db import (
     get_user_settings_from_db,
     save_user_settings_to_db,
 )
-from .gemini_utils import fetch_available_models_for_user
+from .gemini_utils import (
+    fetch_available_models_for_user,
+    forget_cached_client,
+    forget_cached_models,
+)
 from .helpers import check_ai_client, check_db_and_settings, split_and_send_message
 from .processing import (
     process_photo_message,
     process_text_message,
     process_user_message,
+    reset_adk_sessions,
 )
 
-user_temp_state: dict = {}
+# Per-chat conversation state, e.g. that the next text message is an API key. Entries
+# expire, so users who start /set_api_key and never reply don't accumulate forever.
+USER_TEMP_STATE_TTL_SECONDS = 600
+user_temp_state: LRUCache[int, dict[str, bool]] = LRUCache(
+    10_000, ttl=USER_TEMP_STATE_TTL_SECONDS
+)
 
 logger = logging.getLogger(__name__)
 
 CALLBACK_SET_MODEL_PREFIX = "set_model:"
+_CALLBACK_SET_MODEL_PREFIX_LEN = len(CALLBACK_SET_MODEL_PREFIX)
+# Telegram limits callback_data to 64 bytes; this is what remains for the model name.
+_MODEL_NAME_BYTE_BUDGET = 64 - len(CALLBACK_SET_MODEL_PREFIX.encode("utf-8"))
+
+# Top-level Update fields that register_handlers attaches handlers to. Keep in sync
+# with the decorators below; the webhook uses it to drop other update types early.
+HANDLED_UPDATE_TYPES: tuple[str, ...] = ("message", "callback_query")
+
+WELCOME_TEXT = (
+    "Hello! I'm a bot powered by Google Gemini...\n\n"
+    "You can chat with me by sending text or photos (with captions).\n"
+    "I remember our conversation history (up to model limits).\n\n"
+    "Available commands:\n"
+    "/start or /help - Show this message.\n"
+    "/reset - Clear the current chat history.\n"
+    "/set_api_key - Set your personal Gemini API key.\n"
+    "/clear_api_key - Use the bot's default API key (if available).\n"
+    "/list_models - List models available with your current API key.\n"
+    "/select_model - Choose a model using buttons.\n"
+    "/current_settings - Show your active API key status and model.\n\n"
+    "Note: If you set a new API key or model, your chat history will be reset."
+)
+
+# Already converted to MarkdownV2: standardize() parses and re-renders the whole text,
+# so it is done once here rather than on every /set_api_key.
+SET_API_KEY_INSTRUCTIONS = standardize(
+    "Okay, please send me your Google Gemini API key now. \n"
+    "You can get your API key from Google AI Studio:\n"
+    "1. Go to [https://aistudio.google.com/app/apikey](https://aistudio.google.com/app/apikey)\n"
+    "2. Create a new API key \\(or use an existing one\\)\\. \n"
+    "3. Copy the key and paste it into a reply message here\\. \n"
+    "*(Your API key will be stored securely and used only for your interactions. Setting a new key resets chat history and message count)* \n"
+    "Send `/cancel` to abort."
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _build_model_markup(
+    model_names: tuple[str, ...],
+) -> tuple[telebot_types.InlineKeyboardMarkup, int]:
+    """Builds the /select_model keyboard and returns it with its button count.
+
+    Cached by model list: users sharing a key (or tapping /select_model again) get
+    the same markup object, which is only ever serialized, never modified.
+    """
+    markup = telebot_types.InlineKeyboardMarkup()
+    buttons_added = 0
+    for model_name in model_names:
+        # For ASCII (every real model name) the character count is the byte count,
+        # so the UTF-8 encode is skipped.
+        model_name_size = (
+            len(model_name) if model_name.isascii() else len(model_name.encode("utf-8"))
+        )
+        if model_name_size > _MODEL_NAME_BYTE_BUDGET:
+            logger.warning(
+                f"Callback data for model {model_name} exceeds 64 bytes ({model_name_size + 64 - _MODEL_NAME_BYTE_BUDGET}). Skipping button."
+            )
+            continue
+
+        callback_data = f"{CALLBACK_SET_MODEL_PREFIX}{model_name}"
+        button_text = (
+            model_name[len("models/") :]
+            if model_name.startswith("models/")
+            else model_name
+        )
+        if len(button_text) > 30:
+            button_text = button_text[:27] + "..."
+
+        markup.add(
+            telebot_types.InlineKeyboardButton(button_text, callback_data=callback_data)
+        )
+        buttons_added += 1
+    return markup, buttons_added
+
+
+async def _send_fetching_notice(
+    bot_for_reply: AsyncTeleBot, chat_id: int, text: str
+) -> None:
+    """Sends a 'fetching models' notice; failures are logged and otherwise ignored."""
+    try:
+        await bot_for_reply.send_message(chat_id, text)
+    except Exception as e:
+        logger.error(f"Failed to send 'Fetching models' message to {chat_id}: {e}")
 
 
 def register_handlers(bot_instance: AsyncTeleBot) -> None:
@@ -44,22 +140,8 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
             await bot_for_reply.reply_to(message, "Warning: Database connection issue.")
             logger.warning(f"DB unavailable during welcome for {chat_id}.")
 
-        welcome_text = (
-            "Hello! I'm a bot powered by Google Gemini...\n\n"
-            "You can chat with me by sending text or photos (with captions).\n"
-            "I remember our conversation history (up to model limits).\n\n"
-            "Available commands:\n"
-            "/start or /help - Show this message.\n"
-            "/reset - Clear the current chat history.\n"
-            "/set_api_key - Set your personal Gemini API key.\n"
-            "/clear_api_key - Use the bot's default API key (if available).\n"
-            "/list_models - List models available with your current API key.\n"
-            "/select_model - Choose a model using buttons.\n"
-            "/current_settings - Show your active API key status and model.\n\n"
-            "Note: If you set a new API key or model, your chat history will be reset."
-        )
         try:
-            await bot_for_reply.reply_to(message, welcome_text)
+            await bot_for_reply.reply_to(message, WELCOME_TEXT)
             logger.info(f"Sent welcome message to {chat_id}.")
         except Exception as e:
             logger.error(
@@ -88,6 +170,7 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
 
         # Attempt to clear history
         if await clear_history_in_db(chat_id):
+            await reset_adk_sessions(chat_id)
             try:
                 await bot_for_reply.reply_to(message, "Chat history cleared.")
                 logger.info(f"User {chat_id} /reset completed.")
@@ -110,21 +193,12 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
         chat_id = message.chat.id
         logger.info(f"User {chat_id} called /set_api_key")
 
-        user_temp_state[chat_id] = {"awaiting_api_key": True}
+        user_temp_state.set(chat_id, {"awaiting_api_key": True})
 
-        instructions = (
-            "Okay, please send me your Google Gemini API key now. \n"
-            "You can get your API key from Google AI Studio:\n"
-            "1. Go to [https://aistudio.google.com/app/apikey](https://aistudio.google.com/app/apikey)\n"
-            "2. Create a new API key \\(or use an existing one\\)\\. \n"
-            "3. Copy the key and paste it into a reply message here\\. \n"
-            "*(Your API key will be stored securely and used only for your interactions. Setting a new key resets chat history and message count)* \n"
-            "Send `/cancel` to abort."
-        )
         try:
             await bot_for_reply.reply_to(
                 message,
-                standardize(instructions),
+                SET_API_KEY_INSTRUCTIONS,
                 parse_mode="MarkdownV2",
                 disable_web_page_preview=True,
             )
@@ -134,7 +208,7 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
                 f"Failed to send set_api_key instructions to {chat_id}: {e}",
                 exc_info=True,
             )
-            user_temp_state.pop(chat_id, None)
+            user_temp_state.pop(chat_id)
 
     async def handle_cancel_command(
         message: telebot_types.Message, bot_for_reply: AsyncTeleBot
@@ -144,8 +218,9 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
         logger.info(f"User {chat_id} called /cancel")
 
         reply_text = "No active operation to cancel\\."
-        # Access imported user_temp_state
-        if user_temp_state.pop(chat_id, {}).get("awaiting_api_key"):
+        chat_state = user_temp_state.get(chat_id)  # None once expired
+        user_temp_state.pop(chat_id)
+        if chat_state and chat_state.get("awaiting_api_key"):
             reply_text = "Operation cancelled \\(Set API key\\)\\."
             logger.info(f"API key input cancelled for {chat_id}.")
 
@@ -203,7 +278,11 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
             model_name=user_settings.get("selected_model", DEFAULT_MODEL_NAME),
             message_count=0,
         ):
+            previous_api_key = user_settings.get("gemini_api_key")
+            forget_cached_client(previous_api_key)
+            forget_cached_models(previous_api_key)
             await clear_history_in_db(chat_id)
+            await reset_adk_sessions(chat_id)
             reply_text = "Cleared your custom API key\\. Using the bot's default key now\\. Your chat history has been reset\\."
             log_level = logging.INFO
             log_msg = f"User {chat_id} cleared custom API key completed."
@@ -243,15 +322,16 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
             )
             return
 
-        try:
-            await bot_for_reply.send_message(
-                chat_id, "Fetching available models (this might take a moment)..."
-            )
-        except Exception as e:
-            logger.error(f"Failed to send 'Fetching models' message to {chat_id}: {e}")
-            # Proceed anyway, but log the error
-
-        models_info_list = await fetch_available_models_for_user(user_settings)
+        # The notice and the model listing are independent round-trips, so they
+        # overlap; the list itself is only sent after both have finished.
+        _, models_info_list = await asyncio.gather(
+            _send_fetching_notice(
+                bot_for_reply,
+                chat_id,
+                "Fetching available models (this might take a moment)...",
+            ),
+            fetch_available_models_for_user(user_settings),
+        )
 
         if models_info_list is None:
             try:
@@ -279,25 +359,24 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
                 )
             return
 
-        static_header = "Available Models \\(may vary based on API key/region\\):\n\n"
-        models_list_text = static_header
+        # Collected as chunks and joined once; repeated += copied the whole text so far.
+        text_chunks = ["Available Models \\(may vary based on API key/region\\):\n\n"]
         for model_info in models_info_list:
             model_name = model_info.get("name", "Unknown Model")
             display_name = model_name.replace("models/", "")
-            models_list_text += f"💬 **Model name**: `{display_name}`\n"
+            text_chunks.append(f"💬 **Model name**: `{display_name}`\n")
             description = model_info.get("description")
             if description:
-                models_list_text += f"📝 **Description**: ```{description}```\n"
+                text_chunks.append(f"📝 **Description**: ```{description}```\n")
             input_tokens = model_info.get("input_token_limit")
             if input_tokens is not None:
-                models_list_text += f"⬇️ **Input Tokens**: {input_tokens}\n"
+                text_chunks.append(f"⬇️ **Input Tokens**: {input_tokens}\n")
             output_tokens = model_info.get("output_token_limit")
             if output_tokens is not None:
-                models_list_text += f"⬆️ **Output Tokens**: {output_tokens}\n"
-
-            models_list_text += "\n"
-
-        models_list_text += "Use /select_model to choose one\\."
+                text_chunks.append(f"⬆️ **Output Tokens**: {output_tokens}\n")
+            text_chunks.append("\n")
+        text_chunks.append("Use /select_model to choose one\\.")
+        models_list_text = "".join(text_chunks)
 
         await split_and_send_message(
             message, models_list_text, bot_instance=bot_for_reply
@@ -322,14 +401,14 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
         if not ai_client:
             return
 
-        try:
-            await bot_for_reply.send_message(
-                chat_id, "Fetching available models to display as buttons..."
-            )
-        except Exception as e:
-            logger.error(f"Failed to send 'Fetching models' message to {chat_id}: {e}")
-
-        models_info_list = await fetch_available_models_for_user(user_settings)
+        _, models_info_list = await asyncio.gather(
+            _send_fetching_notice(
+                bot_for_reply,
+                chat_id,
+                "Fetching available models to display as buttons...",
+            ),
+            fetch_available_models_for_user(user_settings),
+        )
 
         if models_info_list is None:
             try:
@@ -356,31 +435,9 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
                 )
             return
 
-        # Create inline keyboard markup
-        markup = telebot_types.InlineKeyboardMarkup()
-        buttons_added = 0
-        for model_info in models_info_list:
-            model_name = model_info.get("name")
-            if not model_name:
-                continue
-
-            callback_data = f"{CALLBACK_SET_MODEL_PREFIX}{model_name}"
-            button_text = model_name.replace("models/", "")
-            if len(button_text) > 30:
-                button_text = button_text[:27] + "..."
-
-            if len(callback_data.encode("utf-8")) > 64:
-                logger.warning(
-                    f"Callback data for model {model_name} exceeds 64 bytes. Skipping button."
-                )
-                continue
-
-            markup.add(
-                telebot_types.InlineKeyboardButton(
-                    button_text, callback_data=callback_data
-                )
-            )
-            buttons_added += 1
+        markup, buttons_added = _build_model_markup(
+            tuple(m["name"] for m in models_info_list if m.get("name"))
+        )
 
         if buttons_added == 0:
             try:
@@ -427,25 +484,7 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
 
         callback_data_str: str = call.data
 
-        model_name_from_callback: str | None = None
-
-        if callback_data_str.startswith(CALLBACK_SET_MODEL_PREFIX):
-            try:
-                model_name_from_callback = callback_data_str[
-                    len(CALLBACK_SET_MODEL_PREFIX) :
-                ]
-            except IndexError:
-                logger.error(
-                    f"Unexpected IndexError slicing callback data '{callback_data_str}' for chat {chat_id}"
-                )
-                try:
-                    await bot_for_reply.answer_callback_query(
-                        call.id, "Error: Malformed selection data."
-                    )
-                except Exception:
-                    pass
-                return
-        else:
+        if not callback_data_str.startswith(CALLBACK_SET_MODEL_PREFIX):
             logger.error(
                 f"Callback data '{callback_data_str}' does not start with prefix '{CALLBACK_SET_MODEL_PREFIX}' for chat {chat_id}."
             )
@@ -457,26 +496,27 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
                 pass
             return
 
-        if model_name_from_callback is None:
-            logger.error(
-                f"Failed to extract model name from callback data for chat {chat_id}"
-            )
-            return
+        model_name_from_callback = callback_data_str[_CALLBACK_SET_MODEL_PREFIX_LEN:]
 
         logger.info(
             f"User {chat_id} selected model via button: {model_name_from_callback}"
         )
 
-        try:
-            await bot_for_reply.answer_callback_query(
-                call.id, f"Setting model to {model_name_from_callback}..."
-            )
-        except Exception as e:
-            logger.warning(
-                f"Failed to answer callback query {call.id} for {chat_id}: {e}"
-            )
+        async def answer_callback() -> None:
+            try:
+                await bot_for_reply.answer_callback_query(
+                    call.id, f"Setting model to {model_name_from_callback}..."
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Failed to answer callback query {call.id} for {chat_id}: {e}"
+                )
 
-        user_settings = await get_user_settings_from_db(chat_id)
+        # Acknowledging the tap (Telegram) and loading the settings (Supabase) don't
+        # depend on each other, so they run concurrently.
+        _, user_settings = await asyncio.gather(
+            answer_callback(), get_user_settings_from_db(chat_id)
+        )
         if user_settings is None:
             try:
                 await bot_for_reply.edit_message_text(
@@ -505,6 +545,7 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
                 message_count=0,  # Reset count
             ):
                 await clear_history_in_db(chat_id)  # Clear history on model change
+                await reset_adk_sessions(chat_id)
                 response_text = f"Model set to `{model_name_from_callback}` successfully\! Your chat history has been reset\."
                 logger.info(
                     f"User {chat_id} set model to {model_name_from_callback} completed via callback."
@@ -701,9 +742,10 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
     )
     async def text_message_wrapper(message: telebot_types.Message) -> None:
         chat_id = message.chat.id
-        if user_temp_state.get(chat_id, {}).get("awaiting_api_key"):
+        chat_state = user_temp_state.get(chat_id)
+        if chat_state and chat_state.get("awaiting_api_key"):
             api_key_input = message.text.strip() if message.text else ""
-            user_temp_state.pop(chat_id, None)  # Clear state
+            user_temp_state.pop(chat_id)  # Clear state
 
             if not api_key_input:
                 try:
@@ -719,8 +761,10 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
 
             current_settings = await get_user_settings_from_db(chat_id)
             current_model: str = DEFAULT_MODEL_NAME
+            previous_api_key: str | None = None
             if current_settings:
                 current_model = current_settings["selected_model"]
+                previous_api_key = current_settings["gemini_api_key"]
 
             if await save_user_settings_to_db(
                 chat_id,
@@ -728,7 +772,11 @@ def register_handlers(bot_instance: AsyncTeleBot) -> None:
                 model_name=current_model,
                 message_count=0,
             ):
+                if previous_api_key != api_key_input:
+                    forget_cached_client(previous_api_key)
+                    forget_cached_models(previous_api_key)
                 await clear_history_in_db(chat_id)
+                await reset_adk_sessions(chat_id)
                 reply_text = (
                     f"API key set successfully \\(ending with `...{api_key_input[-4:]}`\\)\\. "
                     f"Your chat history and message count have been reset\\."
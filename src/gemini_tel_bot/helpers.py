@@ -1,11 +1,13 @@
+import asyncio
 import logging
 import re
-from typing import Any
+from typing import Any, Awaitable, Callable
 
 import telegramify_markdown
 from google import genai
 from telebot import types as telebot_types
 from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
 from telegramify_markdown.customize import get_runtime_config
 from telegramify_markdown.interpreters import (
     FileInterpreter,
@@ -17,17 +19,51 @@ from telegramify_markdown.type import ContentTypes
 
 from .config import DEFAULT_KEY_MESSAGE_LIMIT, DEFAULT_MODEL_NAME, GOOGLE_API_KEY
 from .custom_types import UserSettings
-from .db import get_supabase_client, get_user_settings_from_db, save_user_settings_to_db
+from .db import (
+    get_supabase_client,
+    get_user_bundle_from_db,
+    get_user_settings_from_db,
+    increment_message_count_in_db,
+    save_user_settings_to_db,
+)
 from .gemini_utils import get_user_client
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
 get_runtime_config().markdown_symbol.head_level_1 = "📌"
 get_runtime_config().markdown_symbol.link = "🔗"
 
+# Replies shared by the DB and AI client checks, kept in one place so they can't drift.
+DB_UNAVAILABLE_MESSAGE = (
+    "Database service is not available. Bot may not function correctly."
+)
+NO_API_KEY_MESSAGE = "AI service not available. The bot's default API key (GOOGLE_API_KEY) is missing, and you haven't set your own.\n\nPlease use `/set_api_key` to provide your key."
+
+# Replies up to this length are sent as one message without telegramify's splitting.
+# Kept well under Telegram's 4096 limit to leave room for MarkdownV2 escaping.
+_SINGLE_MESSAGE_MAX_CHARS = 3000
+
+# Longest Telegram flood wait (429 retry_after) a reply waits out before giving up.
+_MAX_FLOOD_WAIT_SECONDS = 30
+
+# Messages for default-key users, built once since the limit is fixed at startup.
+_LIMIT_REACHED_MESSAGE = f"You have reached the {DEFAULT_KEY_MESSAGE_LIMIT}-message limit for users without a custom API key.\n\nPlease set your own API key using `/set_api_key` to continue chatting without limits."
+# Warnings sent after a message is counted, keyed by the number of messages remaining.
+_LIMIT_WARNINGS: dict[int, str] = {
+    1: "You have 1 message remaining with the default API key.\n\nPlease use `/set_api_key` to provide your own Gemini API key to send more messages after this one.",
+    0: f"This is your {DEFAULT_KEY_MESSAGE_LIMIT}th and final message using the default API key.\n\nTo send more messages, please use `/set_api_key` to provide your own Gemini API key.",
+}
+
+# telegramify's interpreters keep no per-call state (MermaidInterpreter without a
+# session opens its own for each render), so one chain serves every reply.
+_INTERPRETER_CHAIN = InterpreterChain(
+    [
+        TextInterpreter(),
+        FileInterpreter(),
+        MermaidInterpreter(session=None),
+    ]
+)
+
 
 async def _try_fix_and_resend_mermaid(
     original_mermaid_code: str,
@@ -137,25 +173,66 @@ async def _try_fix_and_resend_mermaid(
         return False
 
 
+async def _send_with_flood_wait(send: Callable[[], Awaitable[Any]]) -> None:
+    """Runs a Telegram send, retrying once after a 429 (Too Many Requests).
+
+    Only this coroutine sleeps, so a rate-limited chat doesn't hold up other updates.
+    A 429 asking for more than _MAX_FLOOD_WAIT_SECONDS, or one hit again on the retry,
+    is re-raised and callers must give up on the reply rather than send it again.
+    """
+    try:
+        await send()
+    except ApiTelegramException as e:
+        if e.error_code != 429:
+            raise
+        retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+        if retry_after > _MAX_FLOOD_WAIT_SECONDS:
+            raise
+        logger.warning(f"Telegram rate limit hit; retrying in {retry_after}s.")
+        await asyncio.sleep(retry_after)
+        await send()
+
+
+def _is_flood_wait(e: Exception) -> bool:
+    """Whether a send failed on a 429 that _send_with_flood_wait didn't wait out."""
+    return isinstance(e, ApiTelegramException) and e.error_code == 429
+
+
 async def split_and_send_message(
     message: telebot_types.Message,
     text: str,
     bot_instance: AsyncTeleBot,
     **kwargs: Any,
 ) -> None:
-
-    interpreter_chain = InterpreterChain(
-        [
-            TextInterpreter(),
-            FileInterpreter(),
-            MermaidInterpreter(session=None),
-        ]
-    )
+    # Most replies are short prose that fits in one message. Those skip telegramify's
+    # splitting and interpreter passes; text with code fences (which may hold Mermaid
+    # diagrams) always takes the full path, as does anything Telegram rejects here.
+    if len(text) <= _SINGLE_MESSAGE_MAX_CHARS and "```" not in text:
+        try:
+            formatted_text = telegramify_markdown.markdownify(
+                text, normalize_whitespace=True, latex_escape=True
+            )
+            await _send_with_flood_wait(
+                lambda: bot_instance.reply_to(
+                    message, formatted_text, parse_mode="MarkdownV2"
+                )
+            )
+            return
+        except Exception as e:
+            if _is_flood_wait(e):
+                # Resending through telegramify would only hit the same rate limit.
+                logger.error(
+                    f"Telegram rate limit for {message.chat.id} outlasted the flood wait; reply dropped: {e}"
+                )
+                return
+            logger.warning(
+                f"Single-message reply to {message.chat.id} failed, retrying through telegramify: {e}"
+            )
 
     try:
         boxs = await telegramify_markdown.telegramify(
             content=text,
-            interpreters_use=interpreter_chain,
+            interpreters_use=_INTERPRETER_CHAIN,
             latex_escape=True,
             normalize_whitespace=True,
             max_word_count=4090,
@@ -166,13 +243,15 @@ async def split_and_send_message(
             try:
                 # We can add delay here if needed using sleep
                 if item.content_type == ContentTypes.TEXT:
-                    await bot_instance.reply_to(
-                        message, item.content, parse_mode="MarkdownV2"
+                    await _send_with_flood_wait(
+                        lambda: bot_instance.reply_to(
+                            message, item.content, parse_mode="MarkdownV2"
+                        )
                     )
                 elif item.content_type == ContentTypes.PHOTO:
                     file_name_to_send = item.file_name
-                    print(
-                        f"Attempting to send PHOTO with filename: {file_name_to_send}"
+                    logger.debug(
+                        "Attempting to send PHOTO with filename: %s", file_name_to_send
                     )
                     await bot_instance.send_photo(
                         message.chat.id,
@@ -182,7 +261,9 @@ async def split_and_send_message(
                     )
                 elif item.content_type == ContentTypes.FILE:
                     file_name_to_send = item.file_name
-                    print(f"Attempting to send FILE with filename: {file_name_to_send}")
+                    logger.debug(
+                        "Attempting to send FILE with filename: %s", file_name_to_send
+                    )
                     if file_name_to_send == "invalid_mermaid.txt" and item.file_data:
                         logger.warning(
                             f"Mermaid diagram rendering failed for chat {message.chat.id}. Original code in item.file_data."
@@ -197,7 +278,7 @@ async def split_and_send_message(
                                 original_mermaid_code_str,
                                 bot_instance,
                                 message,
-                                interpreter_chain,
+                                _INTERPRETER_CHAIN,
                             )
                             if fix_successful:
                                 logger.info(
@@ -250,14 +331,26 @@ async def split_and_send_message(
                             parse_mode="MarkdownV2",
                         )
             except Exception as send_error:
-                print(f"Error sending item {item.content_type}: {send_error}")
+                if _is_flood_wait(send_error):
+                    # The remaining parts and the error notice would be rejected too.
+                    logger.error(
+                        f"Telegram rate limit for {message.chat.id} outlasted the flood wait; rest of the reply dropped: {send_error}"
+                    )
+                    return
+                logger.error(
+                    f"Error sending item {item.content_type} to {message.chat.id}: {send_error}",
+                    exc_info=True,
+                )
                 await bot_instance.send_message(
                     message.chat.id,
                     f"⚠️ Error processing part of the message: {send_error}",
                 )
 
     except Exception as telegramify_error:
-        print(f"Error during telegramify processing: {telegramify_error}")
+        logger.error(
+            f"Error during telegramify processing for {message.chat.id}: {telegramify_error}",
+            exc_info=True,
+        )
 
 
 async def check_db_and_settings(
@@ -267,7 +360,7 @@ async def check_db_and_settings(
     if not await get_supabase_client():
         await bot_instance.reply_to(
             message,
-            "Database service is not available. Bot may not function correctly.",
+            DB_UNAVAILABLE_MESSAGE,
         )
         logger.error(f"DB unavailable for {chat_id}.")
         return None
@@ -283,6 +376,29 @@ async def check_db_and_settings(
     return user_settings
 
 
+async def check_db_and_load_bundle(
+    chat_id: int, message: telebot_types.Message, bot_instance: AsyncTeleBot
+) -> tuple[UserSettings, int] | None:
+    """Like check_db_and_settings, but also returns the chat's next turn_index."""
+    if not await get_supabase_client():
+        await bot_instance.reply_to(
+            message,
+            DB_UNAVAILABLE_MESSAGE,
+        )
+        logger.error(f"DB unavailable for {chat_id}.")
+        return None
+
+    bundle = await get_user_bundle_from_db(chat_id)
+    if bundle is None:
+        await bot_instance.reply_to(
+            message, "Error fetching your settings from the database."
+        )
+        logger.error(f"Failed to fetch settings and turn index for {chat_id}.")
+        return None
+
+    return bundle
+
+
 async def check_ai_client(
     chat_id: int,
     message: telebot_types.Message,
@@ -293,8 +409,7 @@ async def check_ai_client(
     api_key_to_use = user_settings.get("gemini_api_key") or GOOGLE_API_KEY
 
     if not api_key_to_use:
-        error_msg = "AI service not available. The bot's default API key (GOOGLE_API_KEY) is missing, and you haven't set your own.\n\nPlease use `/set_api_key` to provide your key."
-        await bot_instance.reply_to(message, error_msg, parse_mode="Markdown")
+        await bot_instance.reply_to(message, NO_API_KEY_MESSAGE, parse_mode="Markdown")
         logger.error(f"No API key available for {chat_id}.")
         return None
 
@@ -317,83 +432,84 @@ async def check_message_limit_and_increment(
     Helper to check message limit for default key users and increment count.
     Returns True if allowed to proceed, False otherwise (sends message).
     """
-    if user_settings.get("gemini_api_key") is None:
-        current_count = user_settings.get("message_count", 0)
-
-        if DEFAULT_KEY_MESSAGE_LIMIT <= 0:
-            return True
-
-        if current_count >= DEFAULT_KEY_MESSAGE_LIMIT:
-            limit_message = f"You have reached the {DEFAULT_KEY_MESSAGE_LIMIT}-message limit for users without a custom API key.\n\nPlease set your own API key using `/set_api_key` to continue chatting without limits."
-            await bot_instance.reply_to(message, limit_message, parse_mode="Markdown")
-            logger.info(f"User {chat_id} hit default key message limit.")
+    # Users with their own key (or with no limit configured) are never counted.
+    if (
+        user_settings.get("gemini_api_key") is not None
+        or DEFAULT_KEY_MESSAGE_LIMIT <= 0
+    ):
+        return True
+
+    current_count = user_settings.get("message_count", 0)
+
+    if current_count < DEFAULT_KEY_MESSAGE_LIMIT:
+        # One round trip that checks the limit and increments in the database, so
+        # concurrent messages can't both take the last allowed slot.
+        try:
+            new_count = await increment_message_count_in_db(
+                chat_id,
+                DEFAULT_KEY_MESSAGE_LIMIT,
+                user_settings.get("selected_model", DEFAULT_MODEL_NAME),
+            )
+        except Exception:
+            # Already logged; the count is in an unknown state, so don't retry it.
+            await bot_instance.reply_to(
+                message, "Error saving message count. Please try again."
+            )
             return False
+    else:
+        new_count = 0
 
-        else:
-            latest_settings = await get_user_settings_from_db(chat_id)
-            if latest_settings:
-                count_to_save = latest_settings.get("message_count", 0) + 1
-                logger.info(
-                    f"Attempting to increment message count for {chat_id} to {count_to_save}."
-                )
+    if new_count == 0:
+        await bot_instance.reply_to(
+            message, _LIMIT_REACHED_MESSAGE, parse_mode="Markdown"
+        )
+        logger.info(f"User {chat_id} hit default key message limit.")
+        return False
 
-                if await save_user_settings_to_db(
-                    chat_id,
-                    api_key=latest_settings.get("gemini_api_key"),
-                    model_name=latest_settings.get(
-                        "selected_model", DEFAULT_MODEL_NAME
-                    ),
-                    message_count=count_to_save,
-                ):
-                    logger.info(f"Message count incremented and saved for {chat_id}.")
-
-                    messages_remaining = DEFAULT_KEY_MESSAGE_LIMIT - count_to_save
-                    if DEFAULT_KEY_MESSAGE_LIMIT > 0:
-                        if messages_remaining == 1:
-                            warning_message = f"You have 1 message remaining with the default API key.\n\nPlease use `/set_api_key` to provide your own Gemini API key to send more messages after this one."  # Slightly rephrased for clarity
-                            try:
-                                await bot_instance.send_message(
-                                    chat_id, warning_message, parse_mode="Markdown"
-                                )
-                                logger.info(
-                                    f"Sent limit warning: 1 message remaining for {chat_id}."
-                                )
-                            except Exception as send_warn_e:
-                                logger.error(
-                                    f"Failed to send limit warning message to {chat_id}: {send_warn_e}"
-                                )
-                        elif messages_remaining == 0 and DEFAULT_KEY_MESSAGE_LIMIT > 0:
-                            final_warning_message = f"This is your {DEFAULT_KEY_MESSAGE_LIMIT}th and final message using the default API key.\n\nTo send more messages, please use `/set_api_key` to provide your own Gemini API key."
-                            try:
-                                await bot_instance.send_message(
-                                    chat_id,
-                                    final_warning_message,
-                                    parse_mode="Markdown",
-                                )
-                                logger.info(
-                                    f"Sent final limit warning message to {chat_id}."
-                                )
-                            except Exception as send_warn_e:
-                                logger.error(
-                                    f"Failed to send final limit warning message to {chat_id}: {send_warn_e}"
-                                )
+    if new_count is not None:
+        count_to_save = new_count
+        saved = True
+    else:
+        # user_settings was loaded for this message (and is the cached copy when
+        # warm), so it is used directly rather than fetched again before the
+        # increment.
+        count_to_save = current_count + 1
+        logger.info(
+            f"Attempting to increment message count for {chat_id} to {count_to_save}."
+        )
+        saved = await save_user_settings_to_db(
+            chat_id,
+            api_key=user_settings.get("gemini_api_key"),
+            model_name=user_settings.get("selected_model", DEFAULT_MODEL_NAME),
+            message_count=count_to_save,
+        )
 
-                    return True
+    if saved:
+        logger.info(f"Message count incremented and saved for {chat_id}.")
 
-                else:
-                    logger.error(f"Failed to save updated message count for {chat_id}.")
-                    await bot_instance.reply_to(
-                        message, "Error saving message count. Please try again."
-                    )
-                    return False
-            else:
+        messages_remaining = DEFAULT_KEY_MESSAGE_LIMIT - count_to_save
+        warning_message = _LIMIT_WARNINGS.get(messages_remaining)
+        if warning_message is not None:
+            try:
+                await bot_instance.send_message(
+                    chat_id, warning_message, parse_mode="Markdown"
+                )
+                logger.info(
+                    f"Sent limit warning to {chat_id}: {messages_remaining} message(s) remaining."
+                )
+            except Exception as send_warn_e:
                 logger.error(
-                    f"Failed to refetch settings to update message count for {chat_id}."
+                    f"Failed to send limit warning message to {chat_id}: {send_warn_e}"
                 )
-                await bot_instance.reply_to(message, "Error updating message count.")
-                return False
 
-    return True
+        return True
+
+    else:
+        logger.error(f"Failed to save updated message count for {chat_id}.")
+        await bot_instance.reply_to(
+            message, "Error saving message count. Please try again."
+        )
+        return False
 
 
 def sanitize_filename(text: str, max_length: int = 40) -> str:
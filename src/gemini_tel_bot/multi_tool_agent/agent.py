@@ -4,6 +4,7 @@ from google.adk.agents import Agent
 from google.adk.models.google_llm import Gemini
 from google.genai import Client as GenAIClient
 
+from ..cache import LRUCache, key_fingerprint
 from ..config import DEFAULT_MODEL_NAME, GOOGLE_API_KEY
 from .prompt import TELEGRAM_BOT_SYSTEM_INSTRUCTION
 from .tools import (
@@ -205,7 +206,11 @@ class TelegramBotAgent:
             return False
 
 
-_agent_instances_cache: dict[tuple[int, str, str | None], TelegramBotAgent] = {}
+# One agent per (chat, model, key fingerprint). Bounded so chats that switch models or
+# keys, or go quiet, don't keep their agents (and LLM clients) alive forever.
+_agent_instances_cache: LRUCache[tuple[int, str, bytes | None], TelegramBotAgent] = (
+    LRUCache(1024)
+)
 
 
 def get_or_create_agent(
@@ -214,13 +219,16 @@ def get_or_create_agent(
     """
     Retrieves an existing TelegramBotAgent instance or creates a new one.
     """
-    global _agent_instances_cache
-
     normalized_model_name = model_name.replace("models/", "")
-    agent_cache_key = (chat_id, normalized_model_name, api_key)
+    agent_cache_key = (
+        chat_id,
+        normalized_model_name,
+        key_fingerprint(api_key) if api_key is not None else None,
+    )
 
-    if agent_cache_key in _agent_instances_cache:
-        agent_instance = _agent_instances_cache[agent_cache_key]
+    cached_agent_instance = _agent_instances_cache.get(agent_cache_key)
+    if cached_agent_instance is not None:
+        agent_instance = cached_agent_instance
         new_request_effective_api_key = (
             api_key if api_key is not None else GOOGLE_API_KEY
         )
@@ -238,10 +246,7 @@ def get_or_create_agent(
                 logger.error(
                     f"Failed to update mismatched cached TelegramBotAgent instance {agent_instance.root_agent.name}. Removing from cache and re-creating."
                 )
-                try:
-                    del _agent_instances_cache[agent_cache_key]
-                except KeyError:
-                    pass
+                _agent_instances_cache.pop(agent_cache_key)
             else:
                 logger.debug(
                     f"Reusing (after internal update due to mismatch) cached TelegramBotAgent instance for key: {agent_cache_key}"
@@ -260,7 +265,7 @@ def get_or_create_agent(
         agent_instance = TelegramBotAgent(
             chat_id=chat_id, model_name=model_name, api_key=api_key
         )
-        _agent_instances_cache[agent_cache_key] = agent_instance
+        _agent_instances_cache.set(agent_cache_key, agent_instance)
         logger.info(
             f"TelegramBotAgent instance for chat_id {chat_id} created successfully: model='{agent_instance.current_model_name}', "
             f"API key for its ADK Agent's LLM ends with '...{agent_instance.effective_google_api_key[-4:] if agent_instance.effective_google_api_key and len(agent_instance.effective_google_api_key) > 3 else 'N/A'}'."
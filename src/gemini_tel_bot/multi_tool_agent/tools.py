@@ -1,7 +1,6 @@
 import asyncio
 import datetime
 import functools
-import json
 import logging
 import mimetypes
 import os
@@ -16,10 +15,17 @@ from google.genai import types as genai_types
 
 from ..config import IMAGE_GENERATION_MODEL, OPEN_WEATHER_API_KEY, VOICE_MODEL
 from ..db import get_history_from_db
+from ..gemini_utils import get_user_client
 from ..helpers import sanitize_filename
 
 logger = logging.getLogger(__name__)
 
+# get_chat_history returns at most this many of the most recent turns, and drops the
+# oldest of them once the text passes the character budget, so the tool result (which
+# is sent back to the model as input tokens) stays bounded however long turns get.
+HISTORY_TOOL_MAX_TURNS = 10
+HISTORY_TOOL_MAX_CHARS = 12000
+
 
 def get_current_time() -> str:
     """Returns the current date and time."""
@@ -79,7 +85,7 @@ def _fetch_weather_api(
         }
 
 
-def get_weather(city: str, day_offset: int = 0) -> dict:
+async def get_weather(city: str, day_offset: int = 0) -> dict:
     """Retrieves the current weather or a forecast for a specified city using OpenWeatherMap API.
     Args:
         city (str): The name of the city for which to retrieve the weather.
@@ -107,7 +113,10 @@ def get_weather(city: str, day_offset: int = 0) -> dict:
         base_url = "https://api.openweathermap.org/data/2.5/weather"
         params = {"q": city, "appid": api_key, "units": "metric"}
         weather_type = "current"
-        api_response = _fetch_weather_api(base_url, params, city, weather_type)
+        # requests is blocking; run it off the event loop so other chats keep going.
+        api_response = await asyncio.to_thread(
+            _fetch_weather_api, base_url, params, city, weather_type
+        )
         if api_response["status"] == "error":
             return api_response
         weather_data = api_response["data"]
@@ -139,7 +148,10 @@ def get_weather(city: str, day_offset: int = 0) -> dict:
         base_url = "https://api.openweathermap.org/data/2.5/forecast"
         params = {"q": city, "appid": api_key, "units": "metric", "cnt": "40"}
         weather_type = "forecast"
-        api_response = _fetch_weather_api(base_url, params, city, weather_type)
+        # requests is blocking; run it off the event loop so other chats keep going.
+        api_response = await asyncio.to_thread(
+            _fetch_weather_api, base_url, params, city, weather_type
+        )
         if api_response["status"] == "error":
             return api_response
         forecast_data = api_response["data"]
@@ -211,10 +223,12 @@ async def get_chat_history_impl(chat_id: int) -> str:
     if not history_turns:
         return "No history found for this chat yet."
 
-    formatted_history = "Recent chat history (most recent last):\n"
-    for turn_content_obj in history_turns[
-        -10:
-    ]:  # turn_content_obj is a genai_types.Content object
+    # Turns are formatted newest first so the budget keeps the most recent ones.
+    formatted_turns: list[str] = []
+    chars_used = 0
+    for turn_content_obj in reversed(
+        history_turns[-HISTORY_TOOL_MAX_TURNS:]
+    ):  # turn_content_obj is a genai_types.Content object
         role = getattr(turn_content_obj, "role", "unknown")
 
         # The 'parts' attribute of a Content object is already a list of Part objects.
@@ -232,14 +246,11 @@ async def get_chat_history_impl(chat_id: int) -> str:
                 actual_parts
             ):  # part_object is genai_types.Part
                 logger.debug(f"Processing Part {i} from Content object: {part_object}")
-                if hasattr(part_object, "text") and part_object.text is not None:
-                    current_turn_texts.append(str(part_object.text))
+                part_text = getattr(part_object, "text", None)
+                if part_text is not None:
+                    current_turn_texts.append(str(part_text))
                 # Add handling for other part types if necessary for display, e.g., function calls
-                elif (
-                    hasattr(part_object, "function_call")
-                    and part_object.function_call is not None
-                ):
-                    fc = part_object.function_call
+                elif (fc := getattr(part_object, "function_call", None)) is not None:
                     current_turn_texts.append(
                         f"[Function Call: {fc.name} with args {fc.args}]"
                     )
@@ -257,8 +268,16 @@ async def get_chat_history_impl(chat_id: int) -> str:
             else "[no text content in parts]"
         )
         logger.debug(f"Formatted content for turn: '{content}'")
-        formatted_history += f"- {role.capitalize()}: {content}\n"
-    return formatted_history
+        turn_line = f"- {role.capitalize()}: {content}\n"
+        chars_used += len(turn_line)
+        if chars_used > HISTORY_TOOL_MAX_CHARS:
+            if not formatted_turns:  # Always keep (the start of) the latest turn
+                formatted_turns.append(turn_line[:HISTORY_TOOL_MAX_CHARS] + "...\n")
+            break
+        formatted_turns.append(turn_line)
+
+    formatted_turns.append("Recent chat history (most recent last):\n")
+    return "".join(reversed(formatted_turns))
 
 
 def _parse_audio_mime_type_params_for_tools(mime_type: str) -> dict[str, int]:
@@ -334,13 +353,14 @@ async def generate_speech_impl(text_to_speak: str, api_key_for_tool: str) -> dic
             "message": "TTS service not configured (API key missing).",
         }
 
-    def _generate_speech_sync(text_input: str, current_api_key: str) -> dict:
+    def _generate_speech_sync(
+        text_input: str, sync_client: genai.Client, current_api_key: str
+    ) -> dict:
         try:
             qualified_tts_model_name = VOICE_MODEL
             logger.info(
                 f"TTS Sync: Requesting TTS from model: {qualified_tts_model_name} using API key ending ...{current_api_key[-4:] if current_api_key and len(current_api_key) > 3 else 'N/A'}"
             )
-            sync_client = genai.Client(api_key=current_api_key)
             sync_contents = text_input
             speech_generation_config = genai_types.GenerateContentConfig(
                 response_modalities=["AUDIO"],
@@ -405,11 +425,22 @@ async def generate_speech_impl(text_to_speak: str, api_key_for_tool: str) -> dic
                 "message": f"TTS Sync: API Error ({err_code}) - {str(e_sync.message)[:100] if hasattr(e_sync, 'message') else str(e_sync)[:100]}",
             }
 
+    # The client cache is only used from the event loop, so the client is looked up
+    # here and handed to the worker thread.
+    tts_client = get_user_client(api_key_for_tool)
+    if tts_client is None:
+        return {
+            "status": "error",
+            "message": "TTS service not available (could not initialize the AI client).",
+        }
+
     try:
         loop = asyncio.get_event_loop()
         sync_result = await loop.run_in_executor(
             None,
-            functools.partial(_generate_speech_sync, text_to_speak, api_key_for_tool),
+            functools.partial(
+                _generate_speech_sync, text_to_speak, tts_client, api_key_for_tool
+            ),
         )
         if sync_result.get("status") == "success":
             audio_data = sync_result["audio_data"]
@@ -500,13 +531,14 @@ async def generate_image_impl(prompt: str, api_key_for_tool: str) -> dict:
         f"IMAGEN_TOOL: Using API key ending ...{api_key_for_tool[-4:] if api_key_for_tool and len(api_key_for_tool) > 3 else 'N/A'}"
     )
 
-    def _generate_image_sync(image_prompt: str, current_api_key: str) -> dict:
+    def _generate_image_sync(
+        image_prompt: str, sync_client: genai.Client, current_api_key: str
+    ) -> dict:
         try:
             imagen_model_name = IMAGE_GENERATION_MODEL
             logger.info(
                 f"Imagen Sync: Requesting image from {imagen_model_name} using API key ending ...{current_api_key[-4:] if current_api_key and len(current_api_key) > 3 else 'N/A'}"
             )
-            sync_client = genai.Client(api_key=current_api_key)
             config = genai_types.GenerateImagesConfig(
                 number_of_images=1, output_mime_type="image/jpeg", aspect_ratio="1:1"
             )  # Request JPEG
@@ -560,7 +592,6 @@ async def generate_image_impl(prompt: str, api_key_for_tool: str) -> dict:
                     "message": "Image generation failed: Model did not return image data or reason.",
                 }
         except Exception as e_sync:
-            logger.error(f"Imagen Sync: Error: {e_sync}", exc_info=True)
             err_code = getattr(e_sync, "code", "N/A")
             full_error_message = (
                 str(e_sync.message)
@@ -568,7 +599,8 @@ async def generate_image_impl(prompt: str, api_key_for_tool: str) -> dict:
                 else str(e_sync)
             )
             logger.error(
-                f"Imagen Sync: Full error details: Code: {err_code}, Message: {full_error_message}"
+                f"Imagen Sync: Error: Code: {err_code}, Message: {full_error_message}",
+                exc_info=True,
             )
             return {
                 "status": "error",
@@ -584,11 +616,21 @@ async def generate_image_impl(prompt: str, api_key_for_tool: str) -> dict:
                 },
             }
 
+    # Looked up on the event loop for the same reason as in generate_speech_impl.
+    imagen_client = get_user_client(api_key_for_tool)
+    if imagen_client is None:
+        return {
+            "status": "error",
+            "message": "Image generation service not available (could not initialize the AI client).",
+        }
+
     try:
         loop = asyncio.get_event_loop()
         sync_result = await loop.run_in_executor(
             None,
-            functools.partial(_generate_image_sync, prompt, api_key_for_tool),
+            functools.partial(
+                _generate_image_sync, prompt, imagen_client, api_key_for_tool
+            ),
         )
         return sync_result
     except Exception as e_async:
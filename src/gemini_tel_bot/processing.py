@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import logging
 import os
 import re
@@ -13,18 +14,23 @@ from google.api_core.exceptions import (
     NotFound,
     PermissionDenied,
     ResourceExhausted,
-    ServerError,
 )
 from google.genai import errors as genai_errors
 from google.genai import types as genai_types
 from telebot import types as telebot_types
 from telebot.async_telebot import AsyncTeleBot
 
-from .config import DEFAULT_MODEL_NAME, GOOGLE_API_KEY, LOADING_ANIMATION_FILE_ID
-from .custom_types import AIInteractionContext, UserSettings
-from .db import get_history_from_db, save_turn_to_db
+from .config import (
+    DEFAULT_MODEL_NAME,
+    GOOGLE_API_KEY,
+    LOADING_ANIMATION_FILE_ID,
+    MAX_PARALLEL_HANDLERS,
+)
+from .custom_types import AIInteractionContext, PendingTurn, UserSettings
+from .db import reserve_turn_indices, save_turns_in_background
+from .gemini_utils import get_user_client
 from .helpers import (
-    check_db_and_settings,
+    check_db_and_load_bundle,
     check_message_limit_and_increment,
     split_and_send_message,
 )
@@ -36,67 +42,37 @@ logger = logging.getLogger(__name__)
 URL_REGEX = r"(?:(?:https?|ftp):\/\/|www\.)(?:\([-A-Z0-9+&@#\/%?=~_|$!:,.;]*\)|[-A-Z0-9+&@#\/%?=~_|$!:,.;])*(?:\([-A-Z0-9+&@#\/%?=~_|$!:,.;]*\)|[A-Z0-9+&@#\/%?=~_|$])"
 
 # --- ADK Session Management ---
+ADK_APP_NAME = "TelegramGeminiBot"
 _adk_session_service: InMemorySessionService = InMemorySessionService()  # type: ignore[no-any-unimported]
-
-# Module-level client for google.genai.
-_default_genai_client_instance: genai.Client | None = None
-_current_client_api_key_for_default_client: str | None = (
-    "__INITIAL_UNSET__"  # Sentinel to force first init
+# ADK sessions are keyed by (user, chat), but the stored history they mirror belongs to
+# the whole chat. The users with a session in each chat are tracked so that clearing a
+# chat's history (by any member) drops all of them.
+_adk_session_users: dict[int, set[str]] = {}
+
+# Caps how many user messages are processed at once; updates beyond the cap wait here
+# rather than all hitting Supabase and Gemini together.
+_handler_slots: contextlib.AbstractAsyncContextManager[Any] = (
+    asyncio.Semaphore(MAX_PARALLEL_HANDLERS)
+    if MAX_PARALLEL_HANDLERS > 0
+    else contextlib.nullcontext()
 )
 
 
-async def _ensure_default_genai_client(
-    api_key_to_use: str | None,
-) -> genai.Client | None:
-    """
-    Ensures a default genai.Client instance is created with the appropriate API key.
-    This client is intended to be implicitly picked up by ADK Agent's internal
-    GenerativeModel instantiations if no other client context is found.
-    Returns the client instance, or None if creation failed.
-    """
-    global _default_genai_client_instance, _current_client_api_key_for_default_client
-
-    key_for_client_init = (
-        api_key_to_use if api_key_to_use is not None else GOOGLE_API_KEY
-    )
-
-    if not key_for_client_init:
-        logger.error(
-            "Cannot create default genai.Client: No API key available (user key was None, and bot's GOOGLE_API_KEY from config is also not set)."
-        )
-        _default_genai_client_instance = None
-        _current_client_api_key_for_default_client = None
-        return None
-
-    if (
-        _default_genai_client_instance is not None
-        and _current_client_api_key_for_default_client == key_for_client_init
-    ):
-        return _default_genai_client_instance
+async def reset_adk_sessions(chat_id: int) -> None:
+    """Drops every in-memory ADK session for a chat.
 
-    try:
-        prev_key_log = (
-            _current_client_api_key_for_default_client
-            if _current_client_api_key_for_default_client != "__INITIAL_UNSET__"
-            else "initial"
-        )
-        logger.info(
-            f"Creating/Recreating default genai.Client. New key source: {'user-provided' if api_key_to_use else 'bot-default'}. Previous client key: {prev_key_log}"
-        )
-        _default_genai_client_instance = genai.Client(api_key=key_for_client_init)
-        _current_client_api_key_for_default_client = key_for_client_init
-        logger.info(
-            f"Successfully created default genai.Client with key ending ...{key_for_client_init[-4:] if key_for_client_init and len(key_for_client_init) > 3 else ''}"
-        )
-        return _default_genai_client_instance
-    except Exception as e:
-        logger.error(
-            f"Failed to create default genai.Client with key ending ...{key_for_client_init[-4:] if key_for_client_init and len(key_for_client_init) > 3 else ''}: {e}",
-            exc_info=True,
-        )
-        _default_genai_client_instance = None
-        _current_client_api_key_for_default_client = None  # Mark as failed
-        return None
+    A session accumulates every event of the conversation and the agent sees all of
+    them, so the sessions have to go along with the stored history when a chat is reset.
+    """
+    for user_id in _adk_session_users.pop(chat_id, ()):
+        try:
+            await _adk_session_service.delete_session(
+                app_name=ADK_APP_NAME, user_id=user_id, session_id=str(chat_id)
+            )
+        except Exception as e:
+            logger.warning(
+                f"Failed to delete ADK session of user {user_id} for chat {chat_id}: {e}"
+            )
 
 
 def _extract_urls(text: str) -> list[str]:
@@ -106,6 +82,20 @@ def _extract_urls(text: str) -> list[str]:
     return re.findall(URL_REGEX, text, re.IGNORECASE)
 
 
+def _flush_pending_turns(
+    chat_id: int,
+    pending_turns: list[PendingTurn],
+    model_content: genai_types.Content | None = None,
+) -> None:
+    """Saves the buffered turns, plus the model reply if given, in one background upsert."""
+    if model_content is not None and pending_turns:
+        next_turn_index = pending_turns[-1][0] + 1
+        pending_turns.append((next_turn_index, model_content.role, model_content.parts))
+    if pending_turns:
+        save_turns_in_background(chat_id, pending_turns.copy())
+        pending_turns.clear()
+
+
 async def _process_urls_directly(
     message: telebot_types.Message,
     bot_instance: AsyncTeleBot,
@@ -116,6 +106,7 @@ async def _process_urls_directly(
     caption_updated_for_tool: bool,
     chat_id: int,
     urls_found: list[str],  # Should be non-empty if this function is called
+    pending_turns: list[PendingTurn],
 ) -> tuple[bool, bool]:  # (handled_fully, caption_updated)
     """
     Attempts to process the user's message directly using the URL tool if URLs are present.
@@ -171,8 +162,7 @@ async def _process_urls_directly(
             tools=[url_tool], response_mime_type="text/plain"
         )
 
-        direct_response = await asyncio.to_thread(
-            active_genai_client.models.generate_content,
+        direct_response = await active_genai_client.aio.models.generate_content(
             model=f"models/{model_for_agent}",
             contents=user_turn_content,  # Use the passed user_turn_content
             config=url_processing_config,
@@ -207,25 +197,11 @@ async def _process_urls_directly(
 
         # Save turns and send response
 
-        if agent_response_content_for_db_url_tool:
-            # Re-fetch history to get the correct index for the model turn,
-            # as the user turn was saved just before _handle_ai_interaction
-            history_before_model_save = await get_history_from_db(chat_id)
-            model_turn_idx_for_url = (
-                len(history_before_model_save)
-                if history_before_model_save is not None
-                else 0
-            )
-
-            if not await save_turn_to_db(
-                chat_id,
-                turn_index=model_turn_idx_for_url,
-                role=agent_response_content_for_db_url_tool.role,
-                parts=agent_response_content_for_db_url_tool.parts,
-            ):
-                logger.error(
-                    f"Failed to save agent response (URL direct) to DB for {chat_id} at index {model_turn_idx_for_url}"
-                )
+        # The user turn and the model turn go out in one upsert, in the background so
+        # the reply below is not held up by it.
+        _flush_pending_turns(
+            chat_id, pending_turns, agent_response_content_for_db_url_tool
+        )
 
         await split_and_send_message(message, response_text_from_url_tool, bot_instance)
 
@@ -260,10 +236,8 @@ async def _handle_ai_interaction_error(
     model_for_agent: str,
 ) -> None:
     """Handles logging and sending user-facing messages for errors during AI interaction."""
-    logger.error(
-        f"AI Interaction Error for chat {chat_id} (Model: {model_for_agent}): {type(e).__name__} - {str(e)}",
-        exc_info=True,
-    )
+    # Each case below refines log_detail; the error is then logged once, with traceback.
+    log_detail = f"{type(e).__name__} - {str(e)}"
     error_message_to_send = "I encountered an unexpected problem. I've logged the details. Please try again later."
 
     match e:
@@ -274,7 +248,7 @@ async def _handle_ai_interaction_error(
                 f"Code: {e.code if hasattr(e, 'code') else 'N/A'}): "
                 f"{e.message if hasattr(e, 'message') else str(e)}"
             )
-            logger.error(specific_log_msg)
+            log_detail = specific_log_msg
 
             msg_lower = (
                 str(e.message).lower() if hasattr(e, "message") and e.message else ""
@@ -343,35 +317,31 @@ async def _handle_ai_interaction_error(
                 error_message_to_send = f"An AI service client error occurred: {e.message[:150] if hasattr(e, 'message') and e.message else str(e)[:150]}"
 
         case genai_errors.ServerError():
-            logger.error(
-                f"GenAI ServerError for chat {chat_id} (Status: {e.status if hasattr(e, 'status') else 'N/A'}): {e.message if hasattr(e, 'message') else str(e)}"
-            )
+            log_detail = f"GenAI ServerError for chat {chat_id} (Status: {e.status if hasattr(e, 'status') else 'N/A'}): {e.message if hasattr(e, 'message') else str(e)}"
             error_message_to_send = f"The AI service is currently unavailable or encountered a server error (Status: {e.status if hasattr(e, 'status') else 'N/A'}). Please try again later."
 
         case genai_errors.APIError():  # Catch other genai_errors
-            logger.error(
-                f"GenAI APIError for chat {chat_id} (Status: {e.status if hasattr(e, 'status') else 'N/A'}): {e.message if hasattr(e, 'message') else str(e)}"
-            )
+            log_detail = f"GenAI APIError for chat {chat_id} (Status: {e.status if hasattr(e, 'status') else 'N/A'}): {e.message if hasattr(e, 'message') else str(e)}"
             error_message_to_send = f"An unexpected AI service API error occurred (Status: {e.status if hasattr(e, 'status') else 'N/A'}). Please try again."
 
         # google.api_core.exceptions
         case PermissionDenied():
-            logger.error(f"Google API Core Permission denied for chat {chat_id}: {e}")
+            log_detail = f"Google API Core Permission denied for chat {chat_id}: {e}"
             error_message_to_send = (
                 "A general permission error occurred with a Google service."
             )
         case ResourceExhausted():
-            logger.error(f"Google API Core Resource exhausted for chat {chat_id}: {e}")
+            log_detail = f"Google API Core Resource exhausted for chat {chat_id}: {e}"
             error_message_to_send = "A general resource limit was reached with a Google service. This might be related to API quotas."
         case NotFound():
-            logger.error(f"Google API Core Not Found for chat {chat_id}: {e}")
+            log_detail = f"Google API Core Not Found for chat {chat_id}: {e}"
             error_message_to_send = (
                 "A required Google service or resource was not found."
             )
         case (
             ClientError()
         ):  # This is the aliased google.api_core.exceptions.ClientError
-            logger.error(
+            log_detail = (
                 f"A Google API Core ClientError occurred for chat {chat_id}: {e}"
             )
             error_message_to_send = (
@@ -380,14 +350,17 @@ async def _handle_ai_interaction_error(
         case (
             GoogleAPIError()
         ):  # This is the aliased google.api_core.exceptions.GoogleAPIError
-            logger.error(
+            log_detail = (
                 f"A Google API Core GoogleAPIError occurred for chat {chat_id}: {e}"
             )
             error_message_to_send = "A general Google API error occurred."
         case _:  # Default case for any other exceptions
-            # Already logged with exc_info by the caller of this helper
             pass  # error_message_to_send already has a default
 
+    logger.error(
+        f"AI Interaction Error for chat {chat_id} (Model: {model_for_agent}): {log_detail}",
+        exc_info=True,
+    )
     await split_and_send_message(message, error_message_to_send, bot_instance)
 
 
@@ -426,7 +399,7 @@ async def _process_adk_events_and_get_response(  # type: ignore[no-any-unimporte
         new_message=adk_content_for_user_turn,
     ):
         logger.debug(
-            f"ADK Event Loop for {chat_id} - Received event: {event}"
+            "ADK Event Loop for %s - Received event: %s", chat_id, event
         )  # ADDED LOG
         if (
             not caption_updated_for_tool
@@ -500,9 +473,8 @@ async def _process_adk_events_and_get_response(  # type: ignore[no-any-unimporte
                                 f"ADK Tool '{tool_name}' failed for {chat_id}: {tool_error_message}. Full response: {response_data}"
                             )
                             current_llm_text = "".join(
-                                p.text
+                                getattr(p, "text", None) or ""
                                 for p in event.content.parts
-                                if hasattr(p, "text") and p.text
                             ).strip()
                             if (
                                 not current_llm_text
@@ -516,33 +488,38 @@ async def _process_adk_events_and_get_response(  # type: ignore[no-any-unimporte
                                 response_text_from_agent = f"{current_llm_text}\n\nTool Error : {tool_error_message}"
 
         logger.debug(
-            f"ADK Event Loop for {chat_id} - Checking if event is final_response. Event: {event}"
+            "ADK Event Loop for %s - Checking if event is final_response. Event: %s",
+            chat_id,
+            event,
         )
         if event.is_final_response():
-            logger.debug(f"Final ADK Event for {chat_id}: {event}")
+            logger.debug("Final ADK Event for %s: %s", chat_id, event)
             current_final_text = ""
             if event.content:
-                logger.debug(f"Final ADK Event content for {chat_id}: {event.content}")
+                logger.debug(
+                    "Final ADK Event content for %s: %s", chat_id, event.content
+                )
                 if event.content.parts:
                     logger.debug(
-                        f"Final ADK Event parts for {chat_id}: {event.content.parts}"
+                        "Final ADK Event parts for %s: %s", chat_id, event.content.parts
                     )
                     for i, part_item in enumerate(event.content.parts):
                         logger.debug(
-                            f"Final ADK Event part {i} for {chat_id}: {part_item}"
+                            "Final ADK Event part %s for %s: %s", i, chat_id, part_item
                         )
-                        if hasattr(part_item, "text") and part_item.text:
-                            current_final_text += part_item.text
+                        current_final_text += getattr(part_item, "text", None) or ""
                 else:
-                    logger.debug(f"Final ADK Event for {chat_id} has no parts.")
+                    logger.debug("Final ADK Event for %s has no parts.", chat_id)
             else:
-                logger.debug(f"Final ADK Event for {chat_id} has no content.")
+                logger.debug("Final ADK Event for %s has no content.", chat_id)
 
             logger.debug(
-                f"Extracted current_final_text for {chat_id}: '{current_final_text}'"
+                "Extracted current_final_text for %s: '%s'", chat_id, current_final_text
             )
             logger.debug(
-                f"response_text_from_agent before final logic for {chat_id}: '{response_text_from_agent}'"
+                "response_text_from_agent before final logic for %s: '%s'",
+                chat_id,
+                response_text_from_agent,
             )
 
             if (
@@ -552,7 +529,9 @@ async def _process_adk_events_and_get_response(  # type: ignore[no-any-unimporte
             ):
                 response_text_from_agent = current_final_text
                 logger.debug(
-                    f"Set response_text_from_agent to current_final_text for {chat_id}: '{response_text_from_agent}'"
+                    "Set response_text_from_agent to current_final_text for %s: '%s'",
+                    chat_id,
+                    response_text_from_agent,
                 )
             elif (
                 current_final_text.strip()
@@ -573,11 +552,15 @@ async def _process_adk_events_and_get_response(  # type: ignore[no-any-unimporte
                     elif current_final_text:
                         response_text_from_agent += "\n" + current_final_text
                     logger.debug(
-                        f"Appended current_final_text to response_text_from_agent for {chat_id}: '{response_text_from_agent}'"
+                        "Appended current_final_text to response_text_from_agent for %s: '%s'",
+                        chat_id,
+                        response_text_from_agent,
                     )
 
             logger.debug(
-                f"Final response_text_from_agent for {chat_id}: '{response_text_from_agent}'"
+                "Final response_text_from_agent for %s: '%s'",
+                chat_id,
+                response_text_from_agent,
             )
 
             agent_response_content_for_db = (
@@ -672,12 +655,15 @@ async def _setup_ai_interaction_context(
     text_for_url_check = ""
     if user_input_parts:
         for part_item in user_input_parts:
-            if hasattr(part_item, "text") and part_item.text:
-                text_for_url_check += part_item.text + " "
+            part_text = getattr(part_item, "text", None)
+            if part_text:
+                text_for_url_check += part_text + " "
                 break
     urls_found = _extract_urls(text_for_url_check.strip())
 
-    active_genai_client = await _ensure_default_genai_client(effective_api_key)
+    # Clients come from the shared pool keyed by API-key fingerprint, so alternating
+    # users with different keys don't force a new client (and TLS setup) per message.
+    active_genai_client = get_user_client(effective_api_key)
     if not active_genai_client:
         error_msg = "My AI brain isn't configured correctly. Could not initialize the AI client."
         if effective_api_key is None and not GOOGLE_API_KEY:
@@ -703,7 +689,7 @@ async def _setup_ai_interaction_context(
         return None
 
     runner = Runner(
-        app_name="TelegramGeminiBot",
+        app_name=ADK_APP_NAME,
         agent=agent_instance.root_agent,
         session_service=_adk_session_service,
     )
@@ -720,6 +706,7 @@ async def _setup_ai_interaction_context(
                 user_id=user_id_for_agent,
                 session_id=session_id_for_agent,
             )
+        _adk_session_users.setdefault(chat_id, set()).add(user_id_for_agent)
     except Exception as e_sess_ensure:
         logger.error(
             f"Error explicitly ensuring ADK session for {chat_id} (user: {user_id_for_agent}, session: {session_id_for_agent}): {e_sess_ensure}",
@@ -750,28 +737,16 @@ async def _finalize_interaction_and_send_response(
     agent_response_content_for_db: genai_types.Content | None,
     audio_file_to_send: dict | None,
     image_file_to_send: dict | None,
+    pending_turns: list[PendingTurn],
 ) -> None:
     """
-    Saves the agent's turn to the database and sends the response (text, audio, image) to the user.
+    Saves the user's and agent's turns to the database and sends the response (text, audio, image) to the user.
     """
-    # --- Save model's turn to DB ---
-    current_history_after_adk = await get_history_from_db(chat_id)  # Get latest state
-    model_turn_index = (
-        len(current_history_after_adk) if current_history_after_adk is not None else 0
-    )  # Next index for model response
-
-    if agent_response_content_for_db:
-        if not await save_turn_to_db(
-            chat_id,
-            turn_index=model_turn_index,
-            role=agent_response_content_for_db.role,
-            parts=agent_response_content_for_db.parts,
-        ):
-            logger.error(
-                f"Failed to save final agent response to DB for {chat_id} at index {model_turn_index}"
-            )
-    else:
+    # --- Save user and model turns to DB ---
+    if not agent_response_content_for_db:
         logger.warning(f"No agent_response_content_for_db to save for {chat_id}")
+    # One upsert for both turns, in the background so the reply below is not held up.
+    _flush_pending_turns(chat_id, pending_turns, agent_response_content_for_db)
 
     # --- Send response text to user ---
     if (
@@ -790,7 +765,7 @@ async def _finalize_interaction_and_send_response(
         )
 
     # --- Send any generated files (audio/image) ---
-    logger.debug(f"Finalizing: audio_file_to_send = {audio_file_to_send}")
+    logger.debug("Finalizing: audio_file_to_send = %s", audio_file_to_send)
     if audio_file_to_send and audio_file_to_send.get("file_path"):
         audio_path = audio_file_to_send["file_path"]
         try:
@@ -819,7 +794,7 @@ async def _finalize_interaction_and_send_response(
                 message, "Sorry, I had trouble sending the audio."
             )
 
-    logger.debug(f"Finalizing: image_file_to_send = {image_file_to_send}")
+    logger.debug("Finalizing: image_file_to_send = %s", image_file_to_send)
     if image_file_to_send and image_file_to_send.get("file_path"):
         image_path = image_file_to_send["file_path"]
         try:
@@ -854,6 +829,7 @@ async def _handle_ai_interaction(
     user_settings: UserSettings,
     user_input_parts: list[genai_types.Part],
     bot_instance: AsyncTeleBot,
+    pending_turns: list[PendingTurn],
 ) -> None:
     """
     Handles the core AI chat interaction using ADK Agent:
@@ -905,13 +881,17 @@ async def _handle_ai_interaction(
                     caption_updated_for_tool=caption_updated_for_tool,
                     chat_id=chat_id,
                     urls_found=urls_found,
+                    pending_turns=pending_turns,
                 )
             )
             if handled_by_url_tool:
                 return
 
         logger.debug(
-            f"Calling agent runner for {chat_id} | UserID: {user_id_for_agent} | SessionID: {session_id_for_agent}"
+            "Calling agent runner for %s | UserID: %s | SessionID: %s",
+            chat_id,
+            user_id_for_agent,
+            session_id_for_agent,
         )
 
         (
@@ -939,6 +919,7 @@ async def _handle_ai_interaction(
             agent_response_content_for_db=agent_response_content_for_db,
             audio_file_to_send=audio_file_to_send,
             image_file_to_send=image_file_to_send,
+            pending_turns=pending_turns,
         )
 
     except (
@@ -979,15 +960,31 @@ async def process_user_message(
         Coroutine[Any, Any, list[genai_types.Part] | None],
     ],
     bot_instance: AsyncTeleBot,
+) -> None:
+    async with _handler_slots:
+        await _process_user_message(message, content_processor, bot_instance)
+
+
+async def _process_user_message(
+    message: telebot_types.Message,
+    content_processor: Callable[
+        [telebot_types.Message, AsyncTeleBot],
+        Coroutine[Any, Any, list[genai_types.Part] | None],
+    ],
+    bot_instance: AsyncTeleBot,
 ) -> None:
     chat_id = message.chat.id
     logger.info(
         f"Processing user message for chat_id: {chat_id}, content_type: {message.content_type}"
     )
 
-    user_settings = await check_db_and_settings(chat_id, message, bot_instance)
-    if user_settings is None:  # check_db_and_settings handles sending a message
+    # Settings and the chat's next turn_index come back from one fetch (a single RPC
+    # when available). The stored history is not loaded here: the agent works from its
+    # ADK session and reads older turns through the get_chat_history tool.
+    bundle = await check_db_and_load_bundle(chat_id, message, bot_instance)
+    if bundle is None:  # check_db_and_load_bundle handles sending a message
         return
+    user_settings, stored_next_turn_index = bundle
 
     if not await check_message_limit_and_increment(
         chat_id, message, user_settings, bot_instance
@@ -1004,20 +1001,17 @@ async def process_user_message(
         )
         return
 
-    # Save the user's valid turn to the database BEFORE calling the AI
-    # This ensures the user's message is recorded even if AI interaction fails later.
-    current_history_before_ai = await get_history_from_db(chat_id)
-    user_turn_index = len(current_history_before_ai) if current_history_before_ai else 0
-
+    # The user's turn is buffered and written together with the model's reply in a
+    # single upsert. If the AI interaction fails before that, the finally below still
+    # records the user's message on its own. Both indices are reserved now, so other
+    # messages of the chat arriving meanwhile never get the same ones.
+    user_turn_index = reserve_turn_indices(chat_id, 2, stored_next_turn_index)
     # Assuming user_input_parts is always for a 'user' role here
-    if not await save_turn_to_db(chat_id, user_turn_index, "user", user_input_parts):
-        logger.error(
-            f"Failed to save user turn to DB for {chat_id} at index {user_turn_index} BEFORE AI interaction."
-        )
+    pending_turns: list[PendingTurn] = [(user_turn_index, "user", user_input_parts)]
 
     try:
         await _handle_ai_interaction(
-            message, user_settings, user_input_parts, bot_instance
+            message, user_settings, user_input_parts, bot_instance, pending_turns
         )
     except Exception as e_interaction_wrapper:
         logger.error(
@@ -1033,6 +1027,9 @@ async def process_user_message(
             logger.error(
                 f"Failed to send critical error reply to {chat_id}: {e_reply_critical}"
             )
+    finally:
+        # No-op when the reply already flushed the buffered turns.
+        _flush_pending_turns(chat_id, pending_turns)
 
 
 async def process_text_message(
@@ -1042,16 +1039,16 @@ async def process_text_message(
     user_text = message.text
 
     if not user_text or user_text.isspace():
-        logger.info(f"Empty text message from {chat_id}. Ignoring.")
+        logger.info("Empty text message from %s. Ignoring.", chat_id)
         try:
             await bot_instance.reply_to(
                 message, "Please send some text for me to process!"
             )
         except Exception as e:
-            logger.error(f"Failed to send 'empty text' reply to {chat_id}: {e}")
+            logger.error("Failed to send 'empty text' reply to %s: %s", chat_id, e)
         return None  # Indicate no valid parts to process
 
-    logger.info(f"Text message from {chat_id}: '{user_text[:50]}...'")
+    logger.info("Text message from %s: '%s...'", chat_id, user_text[:50])
     return [genai_types.Part(text=user_text)]
 
 
@@ -1060,15 +1057,17 @@ async def process_photo_message(
 ) -> list[genai_types.Part] | None:
     chat_id = message.chat.id
     user_caption = message.caption if message.caption else ""
-    logger.info(
-        f"Photo message from {chat_id}. Caption: '{user_caption[:50]}...'"
-        if user_caption
-        else f"Photo message from {chat_id} (no caption)."
-    )
+    if user_caption:
+        logger.info(
+            "Photo message from %s. Caption: '%s...'", chat_id, user_caption[:50]
+        )
+    else:
+        logger.info("Photo message from %s (no caption).", chat_id)
 
     if not message.photo:  # Should not happen if content_type is 'photo' but good check
         logger.warning(
-            f"Photo message from {chat_id} has no 'photo' attribute despite content_type. Skipping."
+            "Photo message from %s has no 'photo' attribute despite content_type. Skipping.",
+            chat_id,
         )
         try:
             await bot_instance.reply_to(
@@ -1076,7 +1075,9 @@ async def process_photo_message(
                 "There seems to be an issue with the photo you sent. Please try again.",
             )
         except Exception as e:
-            logger.error(f"Failed to send 'no photo attribute' reply to {chat_id}: {e}")
+            logger.error(
+                "Failed to send 'no photo attribute' reply to %s: %s", chat_id, e
+            )
         return None
 
     try:
@@ -1086,7 +1087,9 @@ async def process_photo_message(
 
         if not file_info.file_path:
             logger.error(
-                f"Could not get file_path for photo from {chat_id} (file_id: {photo_to_download.file_id})"
+                "Could not get file_path for photo from %s (file_id: %s)",
+                chat_id,
+                photo_to_download.file_id,
             )
             await bot_instance.reply_to(
                 message,
@@ -1113,11 +1116,17 @@ async def process_photo_message(
                 mime_type = "image/heif"
             else:
                 logger.warning(
-                    f"Unknown photo extension '{ext}' for chat {chat_id}, defaulting to {mime_type}."
+                    "Unknown photo extension '%s' for chat %s, defaulting to %s.",
+                    ext,
+                    chat_id,
+                    mime_type,
                 )
 
         logger.info(
-            f"Downloaded photo for {chat_id}, size: {len(downloaded_file_bytes)} bytes, Determined MIME type: {mime_type}"
+            "Downloaded photo for %s, size: %s bytes, Determined MIME type: %s",
+            chat_id,
+            len(downloaded_file_bytes),
+            mime_type,
         )
 
         image_part = genai_types.Part(
@@ -1134,7 +1143,7 @@ async def process_photo_message(
         return parts_for_gemini
 
     except Exception as e:
-        logger.error(f"Error processing photo for {chat_id}: {e}", exc_info=True)
+        logger.error("Error processing photo for %s: %s", chat_id, e, exc_info=True)
         try:
             await bot_instance.reply_to(
                 message,
@@ -1142,6 +1151,8 @@ async def process_photo_message(
             )
         except Exception as e_reply:  # If replying also fails
             logger.error(
-                f"Failed to send error reply for photo processing to {chat_id}: {e_reply}"
+                "Failed to send error reply for photo processing to %s: %s",
+                chat_id,
+                e_reply,
             )
         return None
@@ -0,0 +1,38 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+from telebot import types as telebot_types
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from gemini_tel_bot.helpers import split_and_send_message
+
+
+def _make_message(chat_id: int) -> telebot_types.Message:
+    return telebot_types.Message.de_json(
+        {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": "hi",
+        }
+    )
+
+
+def test_capped_flood_wait_is_not_resent() -> None:
+    bot = AsyncTeleBot("123:TEST")
+    flood_wait = ApiTelegramException(
+        "sendMessage",
+        None,
+        {
+            "ok": False,
+            "error_code": 429,
+            "description": "Too Many Requests: retry after 600",
+            "parameters": {"retry_after": 600},
+        },
+    )
+    bot.send_message = AsyncMock(side_effect=flood_wait)  # type: ignore[method-assign]
+
+    asyncio.run(split_and_send_message(_make_message(42), "A short reply.", bot))
+
+    assert bot.send_message.await_count == 1
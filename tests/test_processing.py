@@ -0,0 +1,35 @@
+import asyncio
+
+from gemini_tel_bot import processing
+
+
+async def _open_session(user_id: str, chat_id: int) -> None:
+    await processing._adk_session_service.create_session(
+        app_name=processing.ADK_APP_NAME, user_id=user_id, session_id=str(chat_id)
+    )
+    processing._adk_session_users.setdefault(chat_id, set()).add(user_id)
+
+
+async def _has_session(user_id: str, chat_id: int) -> bool:
+    session = await processing._adk_session_service.get_session(
+        app_name=processing.ADK_APP_NAME, user_id=user_id, session_id=str(chat_id)
+    )
+    return session is not None
+
+
+def test_reset_adk_sessions_drops_every_member_of_the_chat() -> None:
+    group_chat_id, other_chat_id = -100, -200
+
+    async def scenario() -> None:
+        await _open_session("1", group_chat_id)
+        await _open_session("2", group_chat_id)
+        await _open_session("1", other_chat_id)
+
+        # User 1 clears the group's history; user 2's session must go with it.
+        await processing.reset_adk_sessions(group_chat_id)
+
+        assert not await _has_session("1", group_chat_id)
+        assert not await _has_session("2", group_chat_id)
+        assert await _has_session("1", other_chat_id)
+
+    asyncio.run(scenario())